@@ -0,0 +1,125 @@
+# Times the databaseManager hot paths on a synthetic league.
+#
+#   python -m benchmarks --players 40 --games 5000 --output bench.json
+#
+# Every benchmark starts cold, without the in-memory league and chemistry,
+# and reports wall time, the number of SQL statements executed and the peak
+# Python memory allocated while it ran.
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from sqlalchemy import event
+from pdlmetrix import init_flask_app, db, chemistry
+from pdlmetrix import league as league_state
+from pdlmetrix import databaseManager as DbManager
+from pdlmetrix.models import Game, Player
+from . import league
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def measure(counter: QueryCounter, func, *args, **kwargs) -> dict:
+    db.session.expire_all()
+    # Otherwise only the first benchmark pays for loading the league
+    league_state.invalidate()
+    chemistry.invalidate()
+    counter.count = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': elapsed,
+        'queries': counter.count,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run(players: int, games: int, days: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = init_flask_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp_dir, "bench.db")}',
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+            'CACHE_MAX_ENTRIES': 0,
+            'CACHE_WARM_UP': False,
+            'AVATAR_CACHE_DIR': os.path.join(tmp_dir, 'avatars'),
+        })
+        with app.app_context():
+            counter = QueryCounter()
+            event.listen(db.engine, 'before_cursor_execute', counter)
+
+            results['load_from_backup'] = measure(
+                counter,
+                league.seed_database, players, games, days, seed
+            )
+
+            player = rng.choice(DbManager.get_all_players())
+            results['games_table_data'] = measure(counter, DbManager.games_table_data)
+            results['games_table_data_page'] = measure(
+                counter,
+                DbManager.games_table_data, limit=50
+            )
+            results['players_table_data'] = measure(counter, DbManager.players_table_data)
+            results['get_player_stats'] = measure(counter, DbManager.get_player_stats, player)
+            results['get_player_partner_enemy'] = measure(
+                counter,
+                DbManager.get_player_partner_enemy, player
+            )
+            results['create_backup'] = measure(counter, DbManager.create_backup)
+
+            player_ids = [p.id for p in Player.query.all()]
+            team = rng.sample(player_ids, 4)
+            results['add_game'] = measure(
+                counter,
+                DbManager.add_game, team[:2], team[2:], [6, 4]
+            )
+
+            game_ids = [g.id for g in Game.query.order_by(Game.datetime, Game.id)]
+            results['remove_game_late'] = measure(counter, DbManager.remove_game, game_ids[-1])
+            results['remove_game_early'] = measure(counter, DbManager.remove_game, game_ids[0])
+
+            event.remove(db.engine, 'before_cursor_execute', counter)
+
+    return {
+        'league': {'players': players, 'games': games, 'days': days, 'seed': seed},
+        'python': sys.version.split()[0],
+        'timestamp': int(time.time()),
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--players', type=int, default=40)
+    parser.add_argument('--games', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    report = json.dumps(run(args.players, args.games, args.days, args.seed), indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
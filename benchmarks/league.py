@@ -0,0 +1,37 @@
+# Synthetic league generator for benchmarks and load tests.
+import io
+import random
+import time
+from typing import List
+
+
+def player_names(players: int) -> List[str]:
+    return [f'player{i}' for i in range(players)]
+
+
+def backup_text(players: int, games: int, days: int, seed: int = 0) -> str:
+    # Returns a backup file (see databaseManager.create_backup) with games
+    # spread evenly over the last days, played by random foursomes.
+    rng = random.Random(seed)
+    names = player_names(players)
+    end = int(time.time())
+    start = end - days * 24 * 60 * 60
+    step = max((end - start) // max(games, 1), 1)
+
+    lines = []
+    for i in range(games):
+        p1, p2, p3, p4 = rng.sample(names, 4)
+        t1score = rng.randint(0, 6)
+        t2score = rng.randint(0, 6)
+        lines.append(f'{p1},{p2},{p3},{p4},{t1score},{t2score},{start + i * step}\n')
+    return ''.join(lines)
+
+
+def backup_file(players: int, games: int, days: int, seed: int = 0) -> io.BytesIO:
+    return io.BytesIO(backup_text(players, games, days, seed).encode('UTF-8'))
+
+
+def seed_database(players: int, games: int, days: int, seed: int = 0) -> dict:
+    # Fills the database of the current app context, returns the import report
+    from pdlmetrix import databaseManager as DbManager
+    return DbManager.load_from_backup(backup_file(players, games, days, seed))
@@ -0,0 +1,320 @@
+# Load test of the app served by a local WSGI server on a synthetic league.
+#
+#   python -m benchmarks.load --clients 32 --seconds 30 --mix index=4,player=4,new_game=1
+#
+# A temporary SQLite database is seeded and the app is served on a free
+# local port by forked server processes that share the listening socket, so
+# the clients don't compete with the server for the GIL and several server
+# processes contend for the database like production workers do. Every
+# client thread sends requests picked from the weighted mix of routes until
+# the time is up. Reports throughput, latency percentiles per route and
+# database lock errors as JSON. Everything runs offline.
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import Dict, List
+from sqlalchemy.exc import OperationalError
+from werkzeug.serving import make_server
+from pdlmetrix import init_flask_app, db
+from pdlmetrix.models import Player, User
+from . import league
+
+USERNAME = 'loadtest'
+PASSWORD = 'loadtest'
+
+DEFAULT_MIX = 'index=4,player=4,chemistry=1,api_games=1,leaderboard=1,new_game=1'
+
+
+def request_index(rng, names, ids):
+    return 'GET', '/', None
+
+
+def request_player(rng, names, ids):
+    return 'GET', f'/player/{urllib.parse.quote(rng.choice(names))}', None
+
+
+def request_chemistry(rng, names, ids):
+    return 'GET', '/chemistry', None
+
+
+def request_api_games(rng, names, ids):
+    return 'GET', '/api/games?limit=50', None
+
+
+def request_leaderboard(rng, names, ids):
+    return 'GET', '/api/leaderboard?limit=50', None
+
+
+def request_new_game(rng, names, ids):
+    t1p1, t1p2, t2p1, t2p2 = rng.sample(ids, 4)
+    form = {
+        't1p1': t1p1,
+        't1p2': t1p2,
+        't2p1': t2p1,
+        't2p2': t2p2,
+        't1score': rng.randint(0, 6),
+        't2score': rng.randint(0, 6),
+    }
+    return 'POST', '/new_game', urllib.parse.urlencode(form)
+
+
+ROUTES = {
+    'index': request_index,
+    'player': request_player,
+    'chemistry': request_chemistry,
+    'api_games': request_api_games,
+    'leaderboard': request_leaderboard,
+    'new_game': request_new_game,
+}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(','):
+        route, _, weight = item.partition('=')
+        assert route in ROUTES, f'Unknown route {route}, expected one of {", ".join(ROUTES)}'
+        mix[route] = float(weight or 1)
+    return mix
+
+
+class LockErrorCounter(logging.Handler):
+    # Counts requests that failed on a locked SQLite database, as logged by
+    # Flask for unhandled exceptions
+    def __init__(self, count):
+        super().__init__(logging.ERROR)
+        self.count = count # shared by the server processes
+
+    def emit(self, record):
+        error = record.exc_info[1] if record.exc_info else None
+        if isinstance(error, OperationalError) and 'locked' in str(error):
+            with self.count.get_lock():
+                self.count.value += 1
+
+
+def serve(app, fd: int, lock_errors) -> None:
+    # Runs in a forked server process
+    with app.app_context():
+        # Connections opened before the fork must not be shared
+        db.engine.dispose()
+    app.logger.addHandler(LockErrorCounter(lock_errors))
+    logging.getLogger('werkzeug').setLevel(logging.WARNING) # no line per request
+    make_server('127.0.0.1', 0, app, threaded=True, fd=fd).serve_forever()
+
+
+def percentile(sorted_values: List[float], share: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    index = max(int(round(share * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def send(port: int, method: str, path: str, body: str = None):
+    # Returns the response status, or the exception name if there was none
+    headers = {}
+    if body is not None:
+        credentials = base64.b64encode(f'{USERNAME}:{PASSWORD}'.encode()).decode()
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        headers['Authorization'] = f'Basic {credentials}'
+
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    except (OSError, http.client.HTTPException) as e:
+        return type(e).__name__
+    finally:
+        connection.close()
+
+
+def client(port: int, mix: Dict[str, float], names, ids, deadline: float, seed: int, results: dict):
+    rng = random.Random(seed)
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+
+    while time.perf_counter() < deadline:
+        route = rng.choices(routes, weights)[0]
+        request = ROUTES[route](rng, names, ids)
+        started = time.perf_counter()
+        status = send(port, *request)
+        elapsed = time.perf_counter() - started
+
+        results[route]['latencies'].append(elapsed)
+        statuses = results[route]['statuses']
+        statuses[status] = statuses.get(status, 0) + 1
+
+
+def route_report(route_results: dict, seconds: float) -> dict:
+    latencies = sorted(route_results['latencies'])
+    statuses = route_results['statuses']
+    errors = sum(
+        count for status, count in statuses.items()
+        if not isinstance(status, int) or status >= 500
+    )
+    report = {
+        'requests': len(latencies),
+        'requests_per_sec': len(latencies) / seconds,
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }
+    for name, share in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99), ('max', 1.0)):
+        value = percentile(latencies, share)
+        report[f'{name}_ms'] = None if value is None else value * 1000
+    return report
+
+
+def run(
+    players: int,
+    games: int,
+    days: int,
+    seed: int,
+    clients: int,
+    seconds: float,
+    mix: Dict[str, float],
+    warm_up: bool,
+    server_processes: int
+) -> dict:
+    fork = multiprocessing.get_context('fork')
+    lock_errors = fork.Value('i', 0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = init_flask_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp_dir, "load.db")}',
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+            'CACHE_WARM_UP': False,
+            'AVATAR_CACHE_DIR': os.path.join(tmp_dir, 'avatars'),
+        })
+        with app.app_context():
+            seeding_started = time.perf_counter()
+            league.seed_database(players, games, days, seed)
+            db.session.add(User(
+                username=USERNAME,
+                password=hashlib.md5(PASSWORD.encode()).hexdigest()
+            ))
+            db.session.commit()
+            seeding_seconds = time.perf_counter() - seeding_started
+            players_by_id = {p.id: p.name for p in Player.query.all()}
+            db.session.remove()
+
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(128)
+        port = listener.getsockname()[1]
+        servers = [
+            fork.Process(target=serve, args=(app, listener.fileno(), lock_errors), daemon=True)
+            for _ in range(server_processes)
+        ]
+        for server in servers:
+            server.start()
+        try:
+            names = list(players_by_id.values())
+            ids = list(players_by_id)
+            if warm_up:
+                # One read of every route first so caches and the in-memory
+                # league are built before timing
+                rng = random.Random(seed)
+                for route in mix:
+                    method, path, body = ROUTES[route](rng, names, ids)
+                    if method == 'GET':
+                        send(port, method, path)
+
+            results = {route: {'latencies': [], 'statuses': {}} for route in mix}
+            started = time.perf_counter()
+            deadline = started + seconds
+            threads = [
+                threading.Thread(
+                    target=client,
+                    args=(port, mix, names, ids, deadline, seed + i, results)
+                )
+                for i in range(clients)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            for server in servers:
+                server.terminate()
+                server.join()
+            listener.close()
+
+    total = sum(len(r['latencies']) for r in results.values())
+    return {
+        'league': {'players': players, 'games': games, 'days': days, 'seed': seed},
+        'load': {'clients': clients, 'seconds': elapsed, 'mix': mix, 'warm_up': warm_up,
+                 'server_processes': server_processes},
+        'python': sys.version.split()[0],
+        'timestamp': int(time.time()),
+        'seeding_seconds': seeding_seconds,
+        'requests': total,
+        'requests_per_sec': total / elapsed,
+        'errors': sum(route_report(r, elapsed)['errors'] for r in results.values()),
+        'lock_errors': lock_errors.value,
+        'routes': {route: route_report(r, elapsed) for route, r in results.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load')
+    parser.add_argument('--players', type=int, default=40)
+    parser.add_argument('--games', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--server-processes', type=int, default=1,
+                        help='forked server processes, each with request threads')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f'weighted routes, default {DEFAULT_MIX}')
+    parser.add_argument('--no-warm-up', dest='warm_up', action='store_false',
+                        help='time the first requests while caches are cold')
+    parser.add_argument('--max-p99-ms', type=float,
+                        help='exit with status 1 if any route is slower at p99')
+    parser.add_argument('--max-errors', type=int,
+                        help='exit with status 1 on more failed requests')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(
+        args.players, args.games, args.days, args.seed,
+        args.clients, args.seconds, args.mix, args.warm_up,
+        args.server_processes
+    )
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+
+    failed = []
+    if args.max_errors is not None and report['errors'] > args.max_errors:
+        failed.append(f'{report["errors"]} failed requests')
+    if args.max_p99_ms is not None:
+        failed += [
+            f'{route} p99 {r["p99_ms"]:.0f}ms'
+            for route, r in report['routes'].items()
+            if r['p99_ms'] is not None and r['p99_ms'] > args.max_p99_ms
+        ]
+    if failed:
+        print('load test failed: ' + ', '.join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,40 @@
+import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_httpauth import HTTPBasicAuth
+from . import cache, metrics
+from . import config as app_config
 
 db = SQLAlchemy()
 auth = HTTPBasicAuth()
 
-def init_flask_app():
+def init_flask_app(config: dict = None):
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///data.db'
+    if app.logger.level == logging.NOTSET:
+        # Flask's handler would only show warnings, startup and job reports
+        # are logged at INFO
+        app.logger.setLevel(logging.INFO)
+    app_config.load_config(app, config)
     db.init_app(app)
+    cache.init_app(app)
     with app.app_context():
+        for bind in (None, 'jobs'):
+            engine = db.get_engine(bind=bind)
+            app_config.init_engine(app, engine)
+            app.logger.info(
+                'storage settings%s: %s',
+                f' ({bind})' if bind else '',
+                app_config.storage_settings(app, engine)
+            )
         from . import routes
-        db.create_all()
+        from . import commands
+        from . import databaseManager
+        from . import migrations
+        migrations.upgrade()
+        metrics.init_app(app, db, auth, databaseManager)
+        if app.config['CACHE_WARM_UP']:
+            from . import changes
+            changes.warm_up(app)
+        from . import jobs
+        jobs.ensure_runner(app)
     return app
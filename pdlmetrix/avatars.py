@@ -0,0 +1,132 @@
+# Player avatars drawn as small SVGs, picked deterministically from a hash
+# of the player name so a player always gets the same face. Generated
+# avatars are kept in memory and in AVATAR_CACHE_DIR (the instance folder's
+# avatars directory by default), where they are pre-generated when players
+# are added or a backup is loaded.
+import hashlib
+import os
+import tempfile
+from typing import Iterable, Tuple
+from flask import current_app
+from .cache import LRUCache
+
+# Bump when the drawing changes so cached files and browser caches expire
+AVATAR_VERSION = 1
+MEMORY_MAX_ENTRIES = 1000
+MEMORY_MAX_BYTES = 4 * 1024 * 1024
+
+BACKGROUNDS = ['#b6e3f4', '#c0aede', '#d1d4f9', '#ffd5dc', '#ffdfbf', '#c1f0c1', '#fbe8a6']
+SKINS = ['#f8d5c2', '#f1c27d', '#e0ac69', '#c68642', '#8d5524', '#ffdbac']
+HAIR_COLORS = ['#2c1b18', '#4a312c', '#724133', '#a55728', '#b58143', '#d6b370', '#c93305', '#e8e1e1']
+SHIRTS = ['#3c4f5c', '#5199e4', '#e05a33', '#25557c', '#65c9ff', '#ff488e', '#7d9f35', '#929598']
+
+HAIRS = [
+    '', # bald
+    '<path d="M18 28 Q18 12 32 12 Q46 12 46 28 Q40 20 32 20 Q24 20 18 28Z" fill="{hair}"/>',
+    '<path d="M16 32 Q14 10 32 10 Q50 10 48 32 L46 24 Q32 14 18 24Z" fill="{hair}"/>',
+    '<path d="M17 30 Q16 11 32 11 Q48 11 47 30 L47 44 L42 44 L42 24 L22 24 L22 44 L17 44Z" fill="{hair}"/>',
+    '<circle cx="32" cy="10" r="6" fill="{hair}"/>'
+    '<path d="M18 28 Q18 14 32 14 Q46 14 46 28 Q32 18 18 28Z" fill="{hair}"/>',
+    '<path d="M19 24 L22 12 L27 18 L32 10 L37 18 L42 12 L45 24 Q32 18 19 24Z" fill="{hair}"/>',
+]
+EYES = [
+    '<circle cx="26" cy="30" r="2" fill="#1f1f1f"/><circle cx="38" cy="30" r="2" fill="#1f1f1f"/>',
+    '<path d="M23 30 Q26 27 29 30 M35 30 Q38 27 41 30" stroke="#1f1f1f" stroke-width="1.5" fill="none"/>',
+    '<rect x="22" y="27" width="8" height="6" rx="2" fill="none" stroke="#1f1f1f" stroke-width="1.2"/>'
+    '<rect x="34" y="27" width="8" height="6" rx="2" fill="none" stroke="#1f1f1f" stroke-width="1.2"/>'
+    '<path d="M30 30 L34 30" stroke="#1f1f1f" stroke-width="1.2"/>'
+    '<circle cx="26" cy="30" r="1.2" fill="#1f1f1f"/><circle cx="38" cy="30" r="1.2" fill="#1f1f1f"/>',
+    '<path d="M23 30 L29 30 M35 30 L41 30" stroke="#1f1f1f" stroke-width="1.5"/>',
+]
+MOUTHS = [
+    '<path d="M27 38 Q32 42 37 38" stroke="#1f1f1f" stroke-width="1.5" fill="none"/>',
+    '<path d="M28 39 L36 39" stroke="#1f1f1f" stroke-width="1.5"/>',
+    '<path d="M27 37 Q32 45 37 37Z" fill="#7a2e2e"/>',
+    '<circle cx="32" cy="39" r="2" fill="#7a2e2e"/>',
+]
+
+_memory = LRUCache(MEMORY_MAX_ENTRIES, MEMORY_MAX_BYTES)
+
+
+def name_digest(player_name: str) -> str:
+    return hashlib.sha256(f'{AVATAR_VERSION}:{player_name}'.encode()).hexdigest()
+
+
+def avatar_svg(player_name: str) -> str:
+    seed = bytes.fromhex(name_digest(player_name))
+
+    def pick(options: list, i: int):
+        return options[seed[i] % len(options)]
+
+    hair = pick(HAIR_COLORS, 3)
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 64 64" width="64" height="64">',
+        f'<circle cx="32" cy="32" r="32" fill="{pick(BACKGROUNDS, 0)}"/>',
+        f'<path d="M12 64 Q12 48 32 48 Q52 48 52 64Z" fill="{pick(SHIRTS, 2)}"/>',
+        f'<rect x="28" y="40" width="8" height="9" fill="{pick(SKINS, 1)}"/>',
+        f'<ellipse cx="32" cy="30" rx="14" ry="16" fill="{pick(SKINS, 1)}"/>',
+        pick(HAIRS, 4).format(hair=hair),
+        pick(EYES, 5),
+        pick(MOUTHS, 6),
+    ]
+    if seed[7] % 4 == 0:
+        parts.append(
+            '<circle cx="23" cy="36" r="2.5" fill="#ff8c8c" opacity="0.5"/>'
+            '<circle cx="41" cy="36" r="2.5" fill="#ff8c8c" opacity="0.5"/>'
+        )
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def cache_dir() -> str:
+    return current_app.config['AVATAR_CACHE_DIR'] or os.path.join(current_app.instance_path, 'avatars')
+
+
+def cache_path(digest: str) -> str:
+    # File names come from the digest as player names can be anything
+    return os.path.join(cache_dir(), f'{digest}.svg')
+
+
+def write_avatar(path: str, svg: bytes) -> None:
+    # Written to a temporary file first so readers never see half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp_file:
+        tmp_file.write(svg)
+    os.replace(tmp_path, path)
+
+
+def get_avatar(player_name: str) -> Tuple[bytes, str]:
+    # Returns the SVG and its ETag
+    digest = name_digest(player_name)
+    svg = _memory.get(digest)
+    if svg is None:
+        path = cache_path(digest)
+        try:
+            with open(path, 'rb') as avatar_file:
+                svg = avatar_file.read()
+        except FileNotFoundError:
+            svg = avatar_svg(player_name).encode()
+            try:
+                write_avatar(path, svg)
+            except OSError:
+                current_app.logger.warning('could not cache avatar in %s', path)
+        _memory.set(digest, svg, len(svg))
+    return svg, digest[:32]
+
+
+def pregenerate(player_names: Iterable[str]) -> int:
+    # Writes the missing avatar files, returns how many were generated
+    generated = 0
+    for player_name in player_names:
+        path = cache_path(name_digest(player_name))
+        if os.path.exists(path):
+            continue
+        try:
+            write_avatar(path, avatar_svg(player_name).encode())
+        except OSError:
+            # Served avatars are generated on demand anyway
+            current_app.logger.warning('could not cache avatars in %s', cache_dir())
+            break
+        generated += 1
+    return generated
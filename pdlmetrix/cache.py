@@ -0,0 +1,111 @@
+# In-process caches for rendered public pages and the data dicts behind them.
+#
+# Everything shown on the public pages only changes when an admin writes, so
+# cached values stay valid until set_data_version is called with a newer
+# change log id (see changes.py). Both caches are bounded LRUs, by entry
+# count and by an estimate of the memory their values take.
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response
+
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class LRUCache:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict() # key: (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+data_version = 0
+page_cache = LRUCache(DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES)
+data_cache = LRUCache(DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES)
+
+
+def init_app(app) -> None:
+    app.config.setdefault('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+    app.config.setdefault('CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    for lru in (page_cache, data_cache):
+        lru.max_entries = app.config['CACHE_MAX_ENTRIES']
+        lru.max_bytes = app.config['CACHE_MAX_BYTES']
+        lru.clear()
+
+
+def set_data_version(version: int) -> None:
+    global data_version
+    if version == data_version:
+        return
+    data_version = version
+    page_cache.clear()
+    data_cache.clear()
+
+
+def memoize(key=lambda *args, **kwargs: (args, tuple(sorted(kwargs.items())))):
+    # Caches a function returning plain data until the next write, key
+    # turns the call arguments into something hashable.
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = (func.__name__, data_version, key(*args, **kwargs))
+            value = data_cache.get(cache_key)
+            if value is None:
+                value = func(*args, **kwargs)
+                data_cache.set(cache_key, value, len(repr(value)))
+            return value
+        return wrapper
+    return decorator
+
+
+def cached_page(view):
+    # Caches the rendered HTML of a view per URL and answers repeat visitors
+    # with 304 Not Modified through the ETag.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache_key = (request.full_path, data_version)
+        page = page_cache.get(cache_key)
+        if page is None:
+            body = view(*args, **kwargs).encode('UTF-8')
+            etag = f'{data_version}-{hashlib.md5(body).hexdigest()[:16]}'
+            page = (body, etag)
+            page_cache.set(cache_key, page, len(body))
+
+        body, etag = page
+        response = make_response(body)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    return wrapper
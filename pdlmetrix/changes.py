@@ -0,0 +1,97 @@
+# Keeps the derived state of a worker process (page and data caches, the
+# in-memory league and its chemistry) in sync with writes made by any
+# worker. Every write in databaseManager appends to padelChangeLog as part
+# of its own transaction, and each worker compares the latest entry to the
+# last one it has seen at the start of every request. A process applies
+# its own writes to its derived state once they are committed.
+import threading
+import time
+from sqlalchemy import event
+from . import db, cache, chemistry, league
+from .models import ChangeLog
+
+PLAYERS = 'players' # players added, games untouched
+GAMES = 'games' # games added, removed or edited
+ALL = 'all' # everything replaced
+
+_seen_id = 0
+_local_ids = set() # committed entries of this process, already applied
+_lock = threading.Lock()
+
+
+def record(kind: str, added_games: list = (), removed_games: list = ()) -> None:
+    # Adds an entry to the current transaction, left for the caller to
+    # commit. Games are (player_ids, scores) to update the chemistry with.
+    entry = ChangeLog(kind=kind, datetime=int(time.time()))
+    db.session.add(entry)
+    db.session.flush()
+    db.session.info.setdefault('pending_changes', []).append(
+        (entry.id, kind, list(added_games), list(removed_games))
+    )
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_committed(session) -> None:
+    pending = session.info.pop('pending_changes', [])
+    if not pending:
+        return
+    with _lock:
+        for change_id, kind, added_games, removed_games in pending:
+            if change_id > _seen_id:
+                # Otherwise refresh already saw it as another worker's
+                _local_ids.add(change_id)
+            if kind == ALL:
+                chemistry.invalidate()
+            else:
+                # Skipped by a chemistry built after the commit
+                chemistry.apply_games(removed_games, -1, change_id)
+                chemistry.apply_games(added_games, 1, change_id)
+        league.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_rolled_back(session) -> None:
+    session.info.pop('pending_changes', None)
+
+
+def refresh() -> None:
+    global _seen_id
+    latest_id = db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+    if latest_id == _seen_id:
+        return
+
+    with _lock:
+        if latest_id == _seen_id:
+            return
+        kinds = {
+            kind for change_id, kind in
+            db.session.query(ChangeLog.id, ChangeLog.kind).filter(
+                ChangeLog.id > _seen_id,
+                ChangeLog.id <= latest_id
+            )
+            if change_id not in _local_ids
+        }
+        # Local game writes update the chemistry in place
+        if GAMES in kinds or ALL in kinds:
+            chemistry.invalidate()
+        league.invalidate()
+        cache.set_data_version(latest_id)
+        _local_ids.difference_update([i for i in _local_ids if i <= latest_id])
+        _seen_id = latest_id
+
+
+def warm_up(app) -> None:
+    # Builds the derived state in a background thread so the first request
+    # of a new worker doesn't pay for it
+    def run():
+        from . import databaseManager as DbManager
+        with app.app_context():
+            refresh()
+            DbManager.get_league()
+            chemistry.get_chemistry(DbManager.load_chemistry_games)
+            DbManager.players_table_data()
+            for player in DbManager.get_all_players():
+                DbManager.get_player_stats(player)
+            db.session.remove()
+
+    threading.Thread(target=run, name='pdlmetrix-warm-up', daemon=True).start()
@@ -0,0 +1,133 @@
+# League-wide partner and opponent round counts kept as player x player
+# matrices. Built in one pass over all games and then kept up to date as
+# games are added or removed, so a profile's best partner and worst opponent
+# are read off one matrix row instead of walking the player's games.
+import threading
+from typing import List, Sequence, Tuple
+import numpy as np
+
+PARTNER_ROUNDS = 0
+PARTNER_WINS = 1
+OPPONENT_ROUNDS = 2
+OPPONENT_WINS = 3
+
+# (player slot, other slot, rounds matrix, wins matrix) for every ordered
+# pair of a game's four slots, slots 0-1 being team 1. Wins are counted
+# for the first player of the pair.
+_PAIRS = [
+    (p, o, PARTNER_ROUNDS, PARTNER_WINS) for p, o in ((0, 1), (1, 0), (2, 3), (3, 2))
+] + [
+    (p, o, OPPONENT_ROUNDS, OPPONENT_WINS) for p, o in (
+        (0, 2), (0, 3), (1, 2), (1, 3), (2, 0), (3, 0), (2, 1), (3, 1)
+    )
+]
+
+
+class Chemistry:
+    def __init__(self, player_ids: Sequence[int] = ()):
+        self.player_ids = list(player_ids)
+        self.index = {p_id: i for i, p_id in enumerate(self.player_ids)}
+        n = len(self.player_ids)
+        self.counts = np.zeros((4, n, n), dtype=np.int32)
+        self.version = 0 # latest change log entry the games include
+
+    def _grow(self, player_ids: Sequence[int]) -> None:
+        new_ids = [p_id for p_id in player_ids if p_id not in self.index]
+        if not new_ids:
+            return
+        for p_id in new_ids:
+            self.index[p_id] = len(self.player_ids)
+            self.player_ids.append(p_id)
+        n = len(self.player_ids)
+        old_n = self.counts.shape[1]
+        counts = np.zeros((4, n, n), dtype=np.int32)
+        counts[:, :old_n, :old_n] = self.counts
+        self.counts = counts
+
+    def add_games(self, games: Sequence[Tuple[Sequence[int], Sequence[int]]], sign: int = 1) -> None:
+        # games are (player_ids, scores) pairs, player_ids being the two
+        # players of team 1 followed by the two of team 2.
+        if not games:
+            return
+        self._grow({p_id for player_ids, _ in games for p_id in player_ids})
+        idx = np.array(
+            [[self.index[p_id] for p_id in player_ids] for player_ids, _ in games],
+            dtype=np.int64
+        )
+        scores = np.array([scores for _, scores in games], dtype=np.int32)
+        total = sign * (scores[:, 0] + scores[:, 1])
+        own_wins = sign * scores[:, [0, 0, 1, 1]]
+
+        for player_slot, other_slot, rounds_matrix, wins_matrix in _PAIRS:
+            rows = idx[:, player_slot]
+            cols = idx[:, other_slot]
+            np.add.at(self.counts[rounds_matrix], (rows, cols), total)
+            np.add.at(self.counts[wins_matrix], (rows, cols), own_wins[:, player_slot])
+
+    def win_ratios(self, rounds_matrix: int, wins_matrix: int) -> np.ndarray:
+        # Win ratio per pair, NaN where the pair has no rounds together
+        rounds = self.counts[rounds_matrix]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(rounds > 0, self.counts[wins_matrix] / rounds, np.nan)
+
+    def partner_enemy(self, player_id: int) -> Tuple[int, float, int, float]:
+        # Returns (best partner id, win ratio, worst opponent id, win ratio),
+        # the ids being None when the player has no partner/opponent.
+        best_partner, best_ratio = None, 0
+        worst_opponent, worst_ratio = None, 100
+        i = self.index.get(player_id)
+        if i is None:
+            return best_partner, best_ratio, worst_opponent, worst_ratio
+
+        partner_rounds = self.counts[PARTNER_ROUNDS, i]
+        if partner_rounds.any():
+            ratios = self.counts[PARTNER_WINS, i] / np.maximum(partner_rounds, 1)
+            ratios[partner_rounds == 0] = -1
+            j = int(ratios.argmax())
+            if ratios[j] > best_ratio:
+                best_partner, best_ratio = self.player_ids[j], float(ratios[j])
+
+        opponent_rounds = self.counts[OPPONENT_ROUNDS, i]
+        if opponent_rounds.any():
+            ratios = self.counts[OPPONENT_WINS, i] / np.maximum(opponent_rounds, 1)
+            ratios[opponent_rounds == 0] = np.inf
+            j = int(ratios.argmin())
+            worst_opponent, worst_ratio = self.player_ids[j], float(ratios[j])
+
+        return best_partner, best_ratio, worst_opponent, worst_ratio
+
+
+_chemistry = None
+_lock = threading.Lock()
+
+
+def get_chemistry(load_games) -> Chemistry:
+    # Returns the league chemistry, building it with load_games() -> (player
+    # ids, games, change log version) the first time or after invalidate().
+    global _chemistry
+    with _lock:
+        if _chemistry is None:
+            player_ids, games, version = load_games()
+            chemistry = Chemistry(player_ids)
+            chemistry.add_games(games)
+            chemistry.version = version
+            _chemistry = chemistry
+        return _chemistry
+
+
+def apply_games(
+    games: List[Tuple[Sequence[int], Sequence[int]]],
+    sign: int = 1,
+    version: int = None
+) -> None:
+    # Keeps a built chemistry up to date with the change log entry version,
+    # nothing to do if it isn't built or was built after that entry
+    with _lock:
+        if _chemistry is not None and (version is None or version > _chemistry.version):
+            _chemistry.add_games(games, sign)
+
+
+def invalidate() -> None:
+    global _chemistry
+    with _lock:
+        _chemistry = None
@@ -0,0 +1,62 @@
+import time
+import click
+from typing import List
+from flask import current_app as app
+from . import db, simulator
+from . import databaseManager as DbManager
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats():
+    """Recompute aggregated player stats and report inconsistencies."""
+    mismatched = DbManager.rebuild_player_stats()
+    db.session.commit()
+    if not mismatched:
+        click.echo('player stats were consistent')
+        return
+    names = [p.name for p in DbManager.get_all_players() if p.id in mismatched]
+    click.echo(f'rebuilt stats of {len(mismatched)} players: {", ".join(names)}')
+
+
+def number_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(',')]
+
+
+@app.cli.command('simulate-ratings')
+@click.option('--k-factors', default='16,24,32,40,48', help='Comma separated K factors.')
+@click.option('--scales', default='200,300,400,500,600', help='Comma separated rating scales.')
+@click.option('--start-ratings', default='1000', help='Comma separated starting ratings.')
+@click.option('--processes', type=int, default=None, help='Worker processes, all cores by default.')
+@click.option('--top', type=int, default=10, help='Number of best configurations to show.')
+def simulate_ratings(k_factors, scales, start_ratings, processes, top):
+    """Replay the game history under a grid of rating parameters and rank them."""
+    games, n_players = DbManager.simulation_games()
+    configs = simulator.config_grid(
+        number_list(k_factors),
+        number_list(scales),
+        [int(r) for r in number_list(start_ratings)],
+    )
+    started = time.time()
+    results = simulator.sweep(games, n_players, configs, processes)
+    click.echo(
+        f'simulated {len(configs)} configurations over {len(games)} games '
+        f'in {time.time() - started:.1f}s'
+    )
+
+    click.echo(f"{'rank':>4} {'K':>6} {'scale':>6} {'start':>6} {'result':>8} "
+               f"{'expect':>7} {'log-loss':>9} {'brier':>7} {'accuracy':>8}")
+    current = {
+        simulator.RatingConfig(): 'current rating',
+        simulator.RatingConfig(proportional=True): 'current rounds rating',
+    }
+    for rank, result in enumerate(results, start=1):
+        config = result.config
+        if rank > top and config not in current:
+            continue
+        click.echo(
+            f'{rank:>4} {config.k_factor:>6g} {config.scale:>6g} {config.start_rating:>6} '
+            f"{'rounds' if config.proportional else 'raw':>8} "
+            f"{'team' if config.team_expectation else 'player':>7} "
+            f'{result.log_loss:>9.4f} {result.brier:>7.4f} {result.accuracy:>8.1%}'
+            + (f' ({current[config]})' if config in current else '')
+        )
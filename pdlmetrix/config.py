@@ -0,0 +1,124 @@
+# Storage configuration. Defaults below can be overridden by a JSON file
+# named in PDLMETRIX_CONFIG, then by PDLMETRIX_<KEY> environment variables
+# (e.g. PDLMETRIX_SQLITE_SYNCHRONOUS=FULL), then by the config dict given
+# to init_flask_app.
+import json
+import os
+from sqlalchemy import event
+
+DEFAULTS = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///data.db',
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    # Applied with PRAGMAs to every new SQLite connection
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_CACHE_SIZE': -64000, # negative is KiB, so 64 MB
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_TEMP_STORE': 'MEMORY',
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    # Used for other database URLs
+    'DATABASE_POOL_SIZE': 5,
+    'DATABASE_POOL_RECYCLE': 1800,
+    # Background jobs, see jobs.py. By default an SQLite database gets its
+    # jobs in a "-jobs" database next to it. Admin operations are queued as
+    # jobs either way, with JOBS_ENABLED off some other worker sharing the
+    # jobs database must run them.
+    'JOBS_DATABASE_URI': None,
+    'JOBS_ENABLED': True,
+    # Build the in-memory league and caches in the background at startup
+    'CACHE_WARM_UP': True,
+    # Generated player avatars, the instance folder's avatars directory if None
+    'AVATAR_CACHE_DIR': None,
+    # Request and SQL instrumentation at /metrics, see metrics.py. Slower
+    # requests are logged with their slowest statements, 0 logs none.
+    'METRICS_ENABLED': False,
+    'METRICS_SLOW_REQUEST_SECONDS': 0.0,
+}
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'SQLITE_JOURNAL_MODE',
+    'synchronous': 'SQLITE_SYNCHRONOUS',
+    'cache_size': 'SQLITE_CACHE_SIZE',
+    'mmap_size': 'SQLITE_MMAP_SIZE',
+    'temp_store': 'SQLITE_TEMP_STORE',
+    'busy_timeout': 'SQLITE_BUSY_TIMEOUT_MS',
+}
+
+
+def load_config(app, config: dict = None) -> None:
+    app.config.update(DEFAULTS)
+    config_file = os.environ.get('PDLMETRIX_CONFIG')
+    if config_file:
+        app.config.from_file(config_file, load=json.load)
+    for key, default in DEFAULTS.items():
+        value = os.environ.get(f'PDLMETRIX_{key}')
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            value = value.lower() in ('1', 'true', 'yes')
+        elif isinstance(default, int):
+            value = int(value)
+        elif isinstance(default, float):
+            value = float(value)
+        app.config[key] = value
+    database_url = os.environ.get('PDLMETRIX_DATABASE_URL')
+    if database_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    if config is not None:
+        app.config.update(config)
+    app.config.setdefault('SQLALCHEMY_BINDS', {}).setdefault(
+        'jobs',
+        app.config['JOBS_DATABASE_URI'] or jobs_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    )
+
+    engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if is_sqlite(app):
+        # sqlite3 waits this long for a lock before raising "database is locked"
+        connect_args = engine_options.setdefault('connect_args', {})
+        connect_args.setdefault('timeout', app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000)
+    else:
+        engine_options.setdefault('pool_size', app.config['DATABASE_POOL_SIZE'])
+        engine_options.setdefault('pool_recycle', app.config['DATABASE_POOL_RECYCLE'])
+        engine_options.setdefault('pool_pre_ping', True)
+
+
+def is_sqlite(app) -> bool:
+    return app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+
+
+def jobs_database_uri(database_uri: str) -> str:
+    if not database_uri.startswith('sqlite:///') or database_uri.endswith(':memory:'):
+        return database_uri
+    path, extension = os.path.splitext(database_uri)
+    return f'{path}-jobs{extension or ".db"}'
+
+
+def init_engine(app, engine) -> None:
+    # Must run before the engine opens its first connection
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = [
+        f'PRAGMA {pragma} = {app.config[key]}'
+        for pragma, key in SQLITE_PRAGMAS.items()
+        if app.config.get(key) is not None
+    ]
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def storage_settings(app, engine) -> dict:
+    # Reports the settings actually in effect on a live connection
+    settings = {
+        'url': repr(engine.url),
+        'pool': type(engine.pool).__name__,
+    }
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as connection:
+            for pragma in SQLITE_PRAGMAS:
+                settings[pragma] = connection.exec_driver_sql(f'PRAGMA {pragma}').scalar()
+    return settings
@@ -1,9 +1,21 @@
 import time
 import hashlib
+from contextlib import contextmanager
+import numpy as np
 from typing import List, Union
-from . import db
-from .models import Player, Game, RatingHistory, User
-from .elo_utils import modified_elo
+from . import db, avatars, cache, changes, chemistry, league, matchmaking
+from .models import (
+    Player, PlayerStats, Game, GameParticipant, RatingHistory, RatingSnapshot, User, ChangeLog
+)
+from .league import League, GameRecord, PlayerRecord
+from .lttb import lttb
+from .elo_utils import START_RATING, expected_result
+from .rating_engine import game_from_row, play_game, replay_games
+
+IMPORT_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+LAST_GAMES_COUNT = 5
+SNAPSHOT_INTERVAL = 500
 
 
 def verify_password(username, password: str) -> bool:
@@ -16,140 +28,515 @@ def verify_password(username, password: str) -> bool:
 def add_player(player_name: str) -> None:
     new_player = Player(
         name=player_name,
-        rating=1000,
-        rating_by_rounds=1000,
+        rating=START_RATING,
+        rating_by_rounds=START_RATING,
     )
     db.session.add(new_player)
+    db.session.flush()
+    db.session.add(PlayerStats(
+        player_id=new_player.id,
+        won_games=0,
+        lost_games=0,
+        won_rounds=0,
+        lost_rounds=0,
+        last_games='',
+    ))
+    refresh_player_ranks()
+    changes.record(changes.PLAYERS)
     db.session.commit()
+    avatars.pregenerate([player_name])
 
 
 def add_game(
     team1_ids: List[int],
     team2_ids: List[int],
     scores: List[int],
-    datetime: str = None
-) -> None:
-    new_game = Game(
-        team1=','.join([str(i) for i in team1_ids]),
-        team2=','.join([str(i) for i in team2_ids]),
-        score=','.join([str(s) for s in scores]),
-        datetime=str(int(time.time())) if datetime is None else datetime
-    )
-    db.session.add(new_game)
-    db.session.commit()
-    update_player_ratings(new_game)
+    datetime: int = None
+) -> int:
+    return add_games([(team1_ids, team2_ids, scores, datetime)])[0]
+
+
+def add_games(games: List[tuple]) -> List[int]:
+    # Records (team1_ids, team2_ids, scores, datetime) games with their
+    # ratings in one transaction, either every game and rating update is
+    # stored or none. Games dated before already played ones are rated in
+    # play order by replaying everything after the earliest of them.
+    # Returns the new game ids.
+    if not games:
+        return []
+
+    with write_transaction():
+        player_ids = {
+            p_id for team1_ids, team2_ids, _, _ in games for p_id in team1_ids + team2_ids
+        }
+        players = {p.id: p for p in Player.query.filter(Player.id.in_(player_ids))}
+        assert len(players) == len(player_ids), 'Game has unknown players'
+
+        now = int(time.time())
+        datetimes = [now if datetime is None else datetime for _, _, _, datetime in games]
+        latest_datetime = db.session.query(db.func.max(Game.datetime)).scalar()
+        in_play_order = all(
+            datetime >= previous for previous, datetime in
+            zip([latest_datetime or datetimes[0]] + datetimes, datetimes)
+        )
 
+        new_games = []
+        for (team1_ids, team2_ids, scores, _), datetime in zip(games, datetimes):
+            scores = [int(s) for s in scores]
+            new_game = Game(
+                team1=','.join([str(i) for i in team1_ids]),
+                team2=','.join([str(i) for i in team2_ids]),
+                score=','.join([str(s) for s in scores]),
+                datetime=datetime
+            )
+            db.session.add(new_game)
+            db.session.flush()
+            db.session.add_all(participants_for_game(new_game.id, team1_ids, team2_ids))
+            apply_game_to_stats(team1_ids, team2_ids, scores)
+            if in_play_order:
+                update_player_ratings(new_game, players)
+            new_games.append(new_game)
+
+        changes.record(changes.GAMES, added_games=[
+            (list(team1_ids) + list(team2_ids), [int(s) for s in scores])
+            for team1_ids, team2_ids, scores, _ in games
+        ])
+        if in_play_order:
+            take_due_snapshot()
+            refresh_player_ranks()
+            db.session.commit()
+        else:
+            refresh_last_games(list(player_ids))
+            # Commits with the games
+            replay_ratings_from(min(datetimes))
+        return [game.id for game in new_games]
 
-def update_player_ratings(game: Game) -> None:
-    team1_ids = [int(p_id) for p_id in game.team1.split(',')]
-    team2_ids = [int(p_id) for p_id in game.team2.split(',')]
-    team1_players = [get_player_by_id(p_id) for p_id in team1_ids]
-    team2_players = [get_player_by_id(p_id) for p_id in team2_ids]
 
-    team1_rating = sum([p.rating for p in team1_players]) / 2
-    team2_rating = sum([p.rating for p in team2_players]) / 2
+def participants_for_game(
+    game_id: int,
+    team1_ids: List[int],
+    team2_ids: List[int]
+) -> List[GameParticipant]:
+    return [
+        GameParticipant(game_id=game_id, player_id=p_id, team=team)
+        for team, team_ids in ((1, team1_ids), (2, team2_ids))
+        for p_id in team_ids
+    ]
+
+
+def update_player_ratings(game: Game, players: dict = None) -> None:
+    # Rates a newly added game and adds its rating checkpoints to the
+    # session, left for the caller to commit. players is {id: Player} and
+    # is loaded with one query when not given.
+    played_game = game_from_row(game.id, game.team1, game.team2, game.score, game.datetime)
+    if players is None:
+        players = {
+            p.id: p for p in
+            Player.query.filter(Player.id.in_(played_game.team1 + played_game.team2))
+        }
+    ratings = {
+        p_id: (players[p_id].rating, players[p_id].rating_by_rounds)
+        for p_id in played_game.team1 + played_game.team2
+    }
 
-    team1_round_rating = sum([p.rating_by_rounds for p in team1_players]) / 2
-    team2_round_rating = sum([p.rating_by_rounds for p in team2_players]) / 2
+    for change in play_game(ratings, played_game):
+        player = players[change.player_id]
+        player.rating = change.rating
+        player.rating_by_rounds = change.rating_by_rounds
+        db.session.add(RatingHistory(**change._asdict()))
 
-    team1_score, team2_score = [int(s) for s in game.score.split(',')]
 
-    for player in team1_players + team2_players:
-        player_in_team1 = player in team1_players
-        opponent_rating = team2_rating if player_in_team1 else team1_rating
-        opponent_round_rating = team2_round_rating if player_in_team1 else team1_round_rating
-        opponent_score = team2_score if player_in_team1 else team1_score
-        own_score = team1_score if player_in_team1 else team2_score
+def remove_game(game_id: int, progress=None) -> None:
+    game_to_remove = get_game_by_id(game_id)
+    assert game_to_remove is not None, f'Game to remove id no match found {game_id}'
+    removed_game_datetime = game_to_remove.datetime
+
+    played_game = game_from_row(
+        game_id,
+        game_to_remove.team1,
+        game_to_remove.team2,
+        game_to_remove.score,
+        game_to_remove.datetime
+    )
+    apply_game_to_stats(played_game.team1, played_game.team2, played_game.scores, sign=-1)
+
+    GameParticipant.query.filter(GameParticipant.game_id == game_id).delete(
+        synchronize_session=False
+    )
+    db.session.delete(game_to_remove)
+    refresh_last_games(played_game.team1 + played_game.team2)
+    changes.record(changes.GAMES, removed_games=[
+        (played_game.team1 + played_game.team2, played_game.scores)
+    ])
+    replay_ratings_from(removed_game_datetime, progress)
+
+
+def edit_game_score(game_id: int, scores: List[int], progress=None) -> None:
+    game_to_edit = get_game_by_id(game_id)
+    assert game_to_edit is not None, f'Game to edit id no match found {game_id}'
+    played_game = game_from_row(
+        game_id,
+        game_to_edit.team1,
+        game_to_edit.team2,
+        game_to_edit.score,
+        game_to_edit.datetime
+    )
+    apply_game_to_stats(played_game.team1, played_game.team2, played_game.scores, sign=-1)
+    apply_game_to_stats(played_game.team1, played_game.team2, scores)
+
+    game_to_edit.score = ','.join([str(s) for s in scores])
+    refresh_last_games(played_game.team1 + played_game.team2)
+    changes.record(
+        changes.GAMES,
+        added_games=[(played_game.team1 + played_game.team2, scores)],
+        removed_games=[(played_game.team1 + played_game.team2, played_game.scores)]
+    )
+    replay_ratings_from(game_to_edit.datetime, progress)
 
-        new_rating = modified_elo(
-            player.rating,
-            opponent_rating,
-            own_score,
-            opponent_score,
-            raw_result=True
-        )
 
-        new_rating_by_rounds = modified_elo(
-            player.rating_by_rounds,
-            opponent_round_rating,
-            own_score,
-            opponent_score,
-            raw_result=False
+def apply_game_to_stats(
+    team1_ids: List[int],
+    team2_ids: List[int],
+    scores: List[int],
+    sign: int = 1
+) -> None:
+    # Adds (or with sign=-1 removes) a game's result to the aggregated
+    # stats of its players. A tie counts as a loss for team 1 and a win for
+    # team 2, as it always has. With sign=1 the result is also appended to
+    # last_games, removals have to call refresh_last_games afterwards.
+    team1_score, team2_score = scores
+    team1_won = team1_score > team2_score
+    player_ids = list(team1_ids) + list(team2_ids)
+    stats_rows = PlayerStats.query.filter(PlayerStats.player_id.in_(player_ids))
+
+    for stats in stats_rows:
+        player_in_team1 = stats.player_id in team1_ids
+        won = team1_won == player_in_team1
+        stats.won_games += sign * int(won)
+        stats.lost_games += sign * int(not won)
+        stats.won_rounds += sign * (team1_score if player_in_team1 else team2_score)
+        stats.lost_rounds += sign * (team2_score if player_in_team1 else team1_score)
+        if sign > 0:
+            last_games = stats.last_games + ('+' if won else '-')
+            stats.last_games = last_games[-LAST_GAMES_COUNT:]
+
+
+def refresh_last_games(player_ids: List[int]) -> None:
+    for player_id in player_ids:
+        recent_games = db.session.query(GameParticipant.team, Game.score).join(
+            Game,
+            Game.id == GameParticipant.game_id
+        ).filter(
+            GameParticipant.player_id == player_id
+        ).order_by(
+            Game.datetime.desc(),
+            Game.id.desc()
+        ).limit(LAST_GAMES_COUNT).all()
+
+        last_games = ''
+        for team, score in reversed(recent_games):
+            team1_score, team2_score = [int(s) for s in score.split(',')]
+            last_games += '+' if (team1_score > team2_score) == (team == 1) else '-'
+        PlayerStats.query.filter(PlayerStats.player_id == player_id).update(
+            {'last_games': last_games},
+            synchronize_session=False
         )
-        rating_diff = new_rating - player.rating
-        rounds_rating_diff = new_rating_by_rounds - player.rating_by_rounds
-        player.rating = new_rating
-        player.rating_by_rounds = new_rating_by_rounds
 
-        set_rating_checkpoint(player, game, rating_diff, rounds_rating_diff)
-        db.session.commit()
 
+def ranked_player_ids(ratings: dict) -> List[int]:
+    # Player ids best first by rating + rating_by_rounds, ratings being
+    # {player_id: (rating, rating_by_rounds)}. Ties go to the older player.
+    return sorted(ratings, key=lambda p_id: (-sum(ratings[p_id]), p_id))
 
-def set_rating_checkpoint(
-    player: Player,
-    game: Game,
-    rating_diff: int,
-    rounds_rating_diff: int
-) -> None:
-    existing_checkpoint = get_history_entry_by_player_and_game(
-        player.id,
-        game.id
-    )
-    if existing_checkpoint is None:
-        new_history = RatingHistory(
-            player_id=player.id,
-            game_id=game.id,
-            rating=player.rating,
-            rating_by_rounds=player.rating_by_rounds,
-            rating_diff=rating_diff,
-            rounds_rating_diff=rounds_rating_diff,
-            datetime=game.datetime
+
+def refresh_player_ranks(ratings: dict = None) -> None:
+    # Stores everyone's rank (see ranked_player_ids), ratings being read
+    # from padelPlayers when not given
+    db.session.flush()
+    if ratings is None:
+        ratings = {
+            p_id: (rating, rating_by_rounds)
+            for p_id, rating, rating_by_rounds
+            in db.session.query(Player.id, Player.rating, Player.rating_by_rounds)
+        }
+    ranked = ranked_player_ids(ratings)
+    stored_ranks = dict(db.session.query(PlayerStats.player_id, PlayerStats.rank))
+    db.session.bulk_update_mappings(PlayerStats, [
+        {'player_id': p_id, 'rank': rank}
+        for rank, p_id in enumerate(ranked, start=1)
+        if stored_ranks.get(p_id) != rank
+    ])
+
+
+def rebuild_player_stats() -> List[int]:
+    # Recomputes padelPlayerStats from scratch and returns the ids of the
+    # players whose stored stats did not match. Left for the caller to commit.
+    stats = {
+        p_id: {
+            'player_id': p_id,
+            'won_games': 0,
+            'lost_games': 0,
+            'won_rounds': 0,
+            'lost_rounds': 0,
+            'last_games': '',
+        }
+        for p_id, in db.session.query(Player.id)
+    }
+    rows = db.session.query(GameParticipant.player_id, GameParticipant.team, Game.score).join(
+        Game,
+        Game.id == GameParticipant.game_id
+    ).order_by(Game.datetime, Game.id)
+
+    for player_id, team, score in rows:
+        if player_id not in stats:
+            continue
+        team1_score, team2_score = [int(s) for s in score.split(',')]
+        own_score, opponent_score = (
+            (team1_score, team2_score) if team == 1 else (team2_score, team1_score)
         )
-        db.session.add(new_history)
-        db.session.commit()
-    else:
-        existing_checkpoint.rating = player.rating
-        existing_checkpoint.rating_by_rounds = player.rating_by_rounds
-        existing_checkpoint.rating_diff = rating_diff
-        existing_checkpoint.rounds_rating_diff = rating_diff
-        db.session.commit()
+        won = (team1_score > team2_score) == (team == 1)
+        player_stats = stats[player_id]
+        player_stats['won_games'] += int(won)
+        player_stats['lost_games'] += int(not won)
+        player_stats['won_rounds'] += own_score
+        player_stats['lost_rounds'] += opponent_score
+        player_stats['last_games'] = (
+            player_stats['last_games'] + ('+' if won else '-')
+        )[-LAST_GAMES_COUNT:]
+
+    ratings = {
+        p_id: (rating, rating_by_rounds)
+        for p_id, rating, rating_by_rounds
+        in db.session.query(Player.id, Player.rating, Player.rating_by_rounds)
+    }
+    ranked = ranked_player_ids(ratings)
+    for rank, p_id in enumerate(ranked, start=1):
+        stats[p_id]['rank'] = rank
+
+    columns = ['won_games', 'lost_games', 'won_rounds', 'lost_rounds', 'last_games', 'rank']
+    stored = {row.player_id: row for row in PlayerStats.query.all()}
+    mismatched = [
+        p_id for p_id, player_stats in stats.items()
+        if p_id not in stored
+        or any(getattr(stored[p_id], c) != player_stats[c] for c in columns)
+    ]
+
+    PlayerStats.query.delete()
+    db.session.bulk_insert_mappings(PlayerStats, list(stats.values()))
+    return mismatched
+
+
+def replay_ratings_from(from_datetime: int, progress=None) -> None:
+    # Recomputes ratings of every game played at or after from_datetime.
+    # Ratings are seeded from the standings just before that point so
+    # earlier games are never touched, and everything is written in a
+    # single transaction that holds the write lock from the first read.
+    # progress(stage, processed, total) is called after each replayed game
+    # when given.
+    with write_transaction():
+        played_ratings = ratings_as_of(from_datetime - 1)
+        ratings = {p.id: (START_RATING, START_RATING) for p in get_all_players()}
+        ratings.update(played_ratings)
+
+        RatingHistory.query.filter(RatingHistory.datetime >= from_datetime).delete(
+            synchronize_session=False
+        )
+        RatingSnapshot.query.filter(RatingSnapshot.datetime >= from_datetime).delete(
+            synchronize_session=False
+        )
+        affected_games = db.session.query(
+            Game.id,
+            Game.team1,
+            Game.team2,
+            Game.score,
+            Game.datetime
+        ).filter(Game.datetime >= from_datetime).order_by(Game.datetime, Game.id)
+
+        played = set(played_ratings)
+        new_snapshots = []
+        counts = {
+            'replayed': 0,
+            'since_snapshot': games_since_snapshot(from_datetime),
+            'total': affected_games.count() if progress is not None else None,
+        }
 
+        def snapshot_after(game, ratings):
+            played.update(game.team1 + game.team2)
+            counts['since_snapshot'] += 1
+            if counts['since_snapshot'] >= SNAPSHOT_INTERVAL:
+                new_snapshots.extend(snapshot_rows(game.datetime, game.id, ratings, played))
+                counts['since_snapshot'] = 0
+            if progress is not None:
+                counts['replayed'] += 1
+                progress('replaying ratings', counts['replayed'], counts['total'])
+
+        ratings, new_history = replay_games(
+            (game_from_row(*row) for row in affected_games),
+            ratings,
+            after_game=snapshot_after
+        )
 
-def remove_game(game_id: int) -> None:
-    game_to_remove = get_game_by_id(game_id)
-    assert game_to_remove is not None, f'Game to remove id no match found {game_id}'
-    removed_game_datetime = int(game_to_remove.datetime)
+        db.session.bulk_insert_mappings(RatingHistory, [c._asdict() for c in new_history])
+        db.session.bulk_insert_mappings(RatingSnapshot, new_snapshots)
+        db.session.bulk_update_mappings(Player, [
+            {'id': p_id, 'rating': rating, 'rating_by_rounds': rating_by_rounds}
+            for p_id, (rating, rating_by_rounds) in ratings.items()
+        ])
+        refresh_player_ranks(ratings)
+        db.session.commit()
 
-    for entry in get_history_entries_by_game_id(game_id):
-        db.session.delete(entry)
-    db.session.delete(game_to_remove)
-    db.session.commit()
-    reset_all_player_ratings()
 
-    games = sorted(get_all_games(), key=lambda h: h.datetime)
-    for game in games:
-        if int(game.datetime) < removed_game_datetime:
-            game_history_entries = get_history_entries_by_game_id(game.id)
-            for entry in game_history_entries:
-                set_rating_from_checkpoint(entry)
-            continue
-        update_player_ratings(game)
+def played_until(datetime_column, game_id_column, datetime: int, game_id: int = None):
+    # Rows at or before (datetime, game_id) in play order, every game of
+    # datetime when game_id is None
+    if game_id is None:
+        return datetime_column <= datetime
+    return db.or_(
+        datetime_column < datetime,
+        db.and_(datetime_column == datetime, game_id_column <= game_id)
+    )
 
 
-def reset_all_player_ratings() -> None:
-    players = get_all_players()
-    for player in players:
-        player.rating = 1000
-        player.rating_by_rounds = 1000
-    db.session.commit()
+def latest_snapshot(datetime: int = None, game_id: int = None) -> Union[tuple, None]:
+    # (datetime, game_id) of the latest snapshot, at or before the given
+    # position when there is one
+    snapshots = db.session.query(RatingSnapshot.datetime, RatingSnapshot.game_id)
+    if datetime is not None:
+        snapshots = snapshots.filter(
+            played_until(RatingSnapshot.datetime, RatingSnapshot.game_id, datetime, game_id)
+        )
+    return snapshots.order_by(
+        RatingSnapshot.datetime.desc(),
+        RatingSnapshot.game_id.desc()
+    ).first()
+
+
+def ratings_as_of(datetime: int, game_id: int = None) -> dict:
+    # Returns {player_id: (rating, rating_by_rounds)} of everyone who had
+    # played by (datetime, game_id), from the nearest snapshot before it
+    # and the rating history after that snapshot.
+    snapshot = latest_snapshot(datetime, game_id)
+    changes_since = db.session.query(
+        RatingHistory.player_id,
+        RatingHistory.rating,
+        RatingHistory.rating_by_rounds
+    ).filter(
+        played_until(RatingHistory.datetime, RatingHistory.game_id, datetime, game_id)
+    )
+
+    ratings = {}
+    if snapshot is not None:
+        ratings = {
+            p_id: (rating, rounds) for p_id, rating, rounds in db.session.query(
+                RatingSnapshot.player_id,
+                RatingSnapshot.rating,
+                RatingSnapshot.rating_by_rounds
+            ).filter(
+                RatingSnapshot.datetime == snapshot.datetime,
+                RatingSnapshot.game_id == snapshot.game_id
+            )
+        }
+        changes_since = changes_since.filter(db.not_(
+            played_until(RatingHistory.datetime, RatingHistory.game_id, *snapshot)
+        ))
+
+    for p_id, rating, rounds in changes_since.order_by(
+        RatingHistory.datetime,
+        RatingHistory.game_id
+    ):
+        ratings[p_id] = (rating, rounds)
+    return ratings
+
+
+def games_since_snapshot(before_datetime: int = None) -> int:
+    games = Game.query
+    if before_datetime is not None:
+        games = games.filter(Game.datetime < before_datetime)
+    snapshot = latest_snapshot()
+    if snapshot is not None:
+        games = games.filter(db.not_(played_until(Game.datetime, Game.id, *snapshot)))
+    return games.count()
+
+
+def snapshot_rows(datetime: int, game_id: int, ratings: dict, player_ids) -> List[dict]:
+    return [
+        {
+            'datetime': datetime,
+            'game_id': game_id,
+            'player_id': p_id,
+            'rating': ratings[p_id][0],
+            'rating_by_rounds': ratings[p_id][1],
+        }
+        for p_id in player_ids
+    ]
+
+
+def take_due_snapshot() -> None:
+    # Snapshots the current ratings once SNAPSHOT_INTERVAL games have been
+    # played after the latest snapshot
+    if games_since_snapshot() < SNAPSHOT_INTERVAL:
+        return
+    db.session.flush()
+    last_game = Game.query.order_by(Game.datetime.desc(), Game.id.desc()).first()
+    ratings = {
+        p_id: (rating, rating_by_rounds)
+        for p_id, rating, rating_by_rounds in db.session.query(
+            Player.id,
+            Player.rating,
+            Player.rating_by_rounds
+        ).join(
+            PlayerStats,
+            PlayerStats.player_id == Player.id
+        ).filter(PlayerStats.won_games + PlayerStats.lost_games > 0)
+    }
+    db.session.bulk_insert_mappings(
+        RatingSnapshot,
+        snapshot_rows(last_game.datetime, last_game.id, ratings, ratings)
+    )
 
 
-def set_rating_from_checkpoint(checkpoint: RatingHistory):
-    player = get_player_by_id(checkpoint.player_id)
-    assert player is not None, f'No player found for history, id: {checkpoint.id}'
-    player.rating = checkpoint.rating
-    player.rating_by_rounds = checkpoint.rating_by_rounds
-    db.session.commit()
+def rebuild_rating_snapshots() -> None:
+    # Recreates every snapshot from the rating history, left for the caller
+    # to commit
+    RatingSnapshot.query.delete()
+    history = db.session.query(
+        RatingHistory.datetime,
+        RatingHistory.game_id,
+        RatingHistory.player_id,
+        RatingHistory.rating,
+        RatingHistory.rating_by_rounds
+    ).order_by(RatingHistory.datetime, RatingHistory.game_id)
+
+    ratings = {}
+    snapshots = []
+    position = None
+    games = 0
+    for datetime, game_id, p_id, rating, rounds in history.yield_per(EXPORT_BATCH_SIZE):
+        if (datetime, game_id) != position:
+            if position is not None and games % SNAPSHOT_INTERVAL == 0:
+                snapshots.extend(snapshot_rows(*position, ratings, ratings))
+            position = (datetime, game_id)
+            games += 1
+        ratings[p_id] = (rating, rounds)
+    if position is not None and games % SNAPSHOT_INTERVAL == 0:
+        snapshots.extend(snapshot_rows(*position, ratings, ratings))
+    db.session.bulk_insert_mappings(RatingSnapshot, snapshots)
+
+
+def leaderboard_as_of(datetime: int, game_id: int = None) -> List[dict]:
+    # Standings right after (datetime, game_id) ranked like PlayerStats.rank
+    ratings = ratings_as_of(datetime, game_id)
+    names = dict(db.session.query(Player.id, Player.name))
+    ranked = ranked_player_ids(ratings)
+    return [
+        {
+            'rank': rank,
+            'name': names[p_id],
+            'rating': ratings[p_id][0],
+            'rounds_rating': ratings[p_id][1],
+        }
+        for rank, p_id in enumerate(ranked, start=1)
+    ]
 
 
 def get_game_by_id(game_id: int) -> Union[Game, None]:
@@ -172,14 +559,6 @@ def get_history_entries_by_player_id(player_id: int) -> Union[List[RatingHistory
     return RatingHistory.query.filter(RatingHistory.player_id == player_id)
 
 
-def get_history_entry_by_player_and_game(
-    player_id: int,
-    game_id: int
-) -> Union[RatingHistory, None]:
-    player_history_entries = RatingHistory.query.filter(RatingHistory.player_id == player_id)
-    return player_history_entries.filter(RatingHistory.game_id == game_id).first()
-
-
 def get_all_players() -> List[Player]:
     return Player.query.all()
 
@@ -192,207 +571,350 @@ def get_all_rating_history() -> List[RatingHistory]:
     return RatingHistory.query.all()
 
 
-def get_players_in_game(game: Game) -> list:
-    # returns players in game as nested list with index 0 being team 1
-    team1 = [get_player_by_id(int(_id)) for _id in game.team1.split(',')]
-    team2 = [get_player_by_id(int(_id)) for _id in game.team2.split(',')]
-    return [team1, team2]
+def get_player_rank(player: Player) -> int:
+    return get_league().players[player.id].rank
+
+
+def get_leaderboard(start: int = 1, limit: int = 50) -> List[dict]:
+    # Players ranked start..start + limit - 1, read through the rank index
+    rows = db.session.query(PlayerStats.rank, Player).join(
+        Player,
+        Player.id == PlayerStats.player_id
+    ).filter(
+        PlayerStats.rank >= start
+    ).order_by(PlayerStats.rank).limit(limit)
+    return [
+        {
+            'rank': rank,
+            'name': player.name,
+            'rating': player.rating,
+            'rounds_rating': player.rating_by_rounds,
+        }
+        for rank, player in rows
+    ]
 
 
-def player_game_result(player: Player, game: Game) -> int:
-    # Returns result for given player for the given match.
-    # 0=loss, 1=tie, 2=win
-    t1 = [get_player_by_id(i) for i in game.team1]
-    t2 = [get_player_by_id(i) for i in game.team2]
-    assert player in t1 + t2, 'Player did not play in given game'
+def leaderboard_api_page(start: int = 1, limit: int = 50) -> dict:
+    players = get_leaderboard(start, limit)
+    next_start = None
+    if len(players) == limit:
+        next_start = players[-1]['rank'] + 1
+    return {'players': players, 'next_start': next_start}
 
-    t1s, t2s = [int(s) for s in game.score.split(',')]
-    if t1s == t2s:
-        return 1
-    if t1s > t2s:
-        return 2 if player in t1 else 0
-    return 2 if player in t2 else 0
 
+def get_player_partner_enemy(player: Player) -> dict:
+    # returns two other players in dict which the given
+    # player has best win rate with and worst win rate against.
+    best_partner, best_partner_win_ratio, worst_opponent, worst_opponent_win_ratio = (
+        chemistry.get_chemistry(load_chemistry_games).partner_enemy(player.id)
+    )
 
-def get_games_by_player(player: Player) -> List[Game]:
-    # todo: refactor to take into account +10 players
-    return Game.query.filter((Game.team1 + Game.team2).contains(str(player.id)))
+    others = get_league().players
+    return {
+        'best_partner': others.get(best_partner),
+        'best_partner_win_ratio': best_partner_win_ratio * 100,
+        'worst_opponent': others.get(worst_opponent),
+        'worst_opponent_win_ratio': worst_opponent_win_ratio * 100
+    }
 
 
-def get_player_rank(player: Player) -> int:
-    players = get_all_players()
-    rank_sum = lambda p: p.rating + p.rating_by_rounds
-    sorted_by_rank = sorted(players, key=rank_sum, reverse=True)
-    return sorted_by_rank.index(player) + 1
+def load_chemistry_games() -> tuple:
+    league_data = get_league()
+    games = [(game.player_ids, game.scores) for game in league_data.games]
+    return list(league_data.players), games, league_data.version
+
+
+def simulation_games() -> tuple:
+    # The whole history in play order for simulator.sweep, players numbered
+    # 0..n_players - 1
+    league_data = get_league()
+    index = {p_id: i for i, p_id in enumerate(league_data.players)}
+    games = [
+        tuple([index[p_id] for p_id in game.player_ids]) + game.scores
+        for game in league_data.games
+    ]
+    return games, len(index)
+
+
+@contextmanager
+def read_transaction():
+    # pysqlite doesn't begin transactions for SELECTs, so every query of a
+    # multi-query read could see a different commit. An explicit BEGIN
+    # makes them all read from one snapshot.
+    connection = db.session.connection()
+    began = connection.dialect.name == 'sqlite' and not connection.connection.in_transaction
+    if began:
+        connection.exec_driver_sql('BEGIN')
+    try:
+        yield
+    finally:
+        if began and connection.connection.in_transaction:
+            connection.exec_driver_sql('COMMIT')
+
+
+@contextmanager
+def write_transaction():
+    # pysqlite only begins a transaction at the first write, so whatever was
+    # read to compute it could be changed by another writer in between.
+    # BEGIN IMMEDIATE takes the write lock before the first read instead.
+    # The caller commits, an error rolls everything back.
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    try:
+        yield
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def load_league() -> League:
+    # Reads the whole league with one query per table, all from the same
+    # snapshot of the database
+    with read_transaction():
+        version = db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+        players = [
+            PlayerRecord(player, stats) for player, stats in
+            db.session.query(Player, PlayerStats).join(
+                PlayerStats,
+                PlayerStats.player_id == Player.id
+            ).order_by(Player.id)
+        ]
+
+        games = {}
+        for game_id, team1, team2, score, datetime in db.session.query(
+            Game.id,
+            Game.team1,
+            Game.team2,
+            Game.score,
+            Game.datetime
+        ).order_by(Game.datetime, Game.id):
+            games[game_id] = GameRecord(
+                game_id,
+                tuple([int(p_id) for p_id in team1.split(',')]),
+                tuple([int(p_id) for p_id in team2.split(',')]),
+                tuple([int(s) for s in score.split(',')]),
+                datetime
+            )
 
+        ratings = {}
+        for game_id, player_id, *rating in db.session.query(
+            RatingHistory.game_id,
+            RatingHistory.player_id,
+            RatingHistory.rating,
+            RatingHistory.rating_by_rounds,
+            RatingHistory.rating_diff,
+            RatingHistory.rounds_rating_diff
+        ):
+            ratings[(game_id, player_id)] = tuple(rating)
+        for game in games.values():
+            game.ratings = tuple([ratings.pop((game.id, p_id)) for p_id in game.player_ids])
 
-def get_player_partner_enemy(player: Player) -> dict:
-    # returns two other players in dict which the given
-    # player has best win rate with and worst win rate against.
-    all_games = get_games_by_player(player)
-    others_stats = {}
+        return League(list(games.values()), players, version)
 
-    for game in all_games:
-        team1, team2 = get_players_in_game(game)
-        t1score, t2score = [int(s) for s in game.score.split(',')]
-        team1_won = t1score > t2score
-        player_in_team1 = player in team1
 
+def get_league() -> League:
+    return league.get_league(load_league)
 
-        for other_player in team1 + team2:
-            if other_player == player:
-                continue
-            played_as_a_team = player_in_team1 == (other_player in team1)
-            if other_player not in others_stats:
-                others_stats[other_player] = {
-                    'rounds_as_partner': 0,
-                    'wins_as_partner': 0,
-                    'rounds_against': 0,
-                    'wins_against': 0
-                }
-            if played_as_a_team:
-                others_stats[other_player]['rounds_as_partner'] += t1score + t2score
-                won_rounds = t1score if player_in_team1 else t2score
-                others_stats[other_player]['wins_as_partner'] += won_rounds
-            else:
-                others_stats[other_player]['rounds_against'] += t1score + t2score
-                won_rounds = t1score if player_in_team1 else t2score
-                others_stats[other_player]['wins_against'] += won_rounds
-
-    best_partner = None
-    best_partner_win_ratio = 0
-    worst_opponent = None
-    worst_opponent_win_ratio = 100
-
-    for other, stats in others_stats.items():
-        try:
-            win_ratio_as_partner = stats['wins_as_partner'] / stats['rounds_as_partner']
-            if win_ratio_as_partner > best_partner_win_ratio:
-                best_partner_win_ratio = win_ratio_as_partner
-                best_partner = other
-        except ZeroDivisionError:
-            pass
 
-        try:
-            win_ratio_against = stats['wins_against'] / stats['rounds_against']
-            if win_ratio_against < worst_opponent_win_ratio:
-                worst_opponent_win_ratio = win_ratio_against
-                worst_opponent = other
-        except ZeroDivisionError:
-            pass
+def get_player_record(player_name: str) -> Union[PlayerRecord, None]:
+    return get_league().players_by_name.get(player_name)
+
 
+def chemistry_table_data() -> dict:
+    # Partner and opponent round win ratios of every pair of players,
+    # None where the pair never played together/against each other.
+    league_chemistry = chemistry.get_chemistry(load_chemistry_games)
+    players = get_league().players
+    in_league = [i for i, p_id in enumerate(league_chemistry.player_ids) if p_id in players]
+
+    def ratios(rounds_matrix, wins_matrix):
+        matrix = league_chemistry.win_ratios(rounds_matrix, wins_matrix)
+        matrix = matrix[np.ix_(in_league, in_league)]
+        return [[None if np.isnan(r) else round(float(r), 3) for r in row] for row in matrix]
 
     return {
-        'best_partner': best_partner,
-        'best_partner_win_ratio': best_partner_win_ratio * 100,
-        'worst_opponent': worst_opponent,
-        'worst_opponent_win_ratio': worst_opponent_win_ratio * 100
+        'players': [players[league_chemistry.player_ids[i]].name for i in in_league],
+        'partner_win_ratio': ratios(chemistry.PARTNER_ROUNDS, chemistry.PARTNER_WINS),
+        'opponent_win_ratio': ratios(chemistry.OPPONENT_ROUNDS, chemistry.OPPONENT_WINS),
     }
 
 
-def get_games_by_player_formatted(player: Player) -> List[dict]:
-    games = sorted(get_games_by_player(player), key=lambda g: int(g.datetime), reverse=True)
+def matchmaking_courts(
+    player_names: List[str],
+    recent_games: int = 10,
+    partner_penalty: float = 0.05
+) -> dict:
+    # Balanced 2v2 games for the players present. When they don't fill the
+    # courts, those who played the most of the recent games sit out.
+    league_data = get_league()
+    players = [league_data.players_by_name[name] for name in player_names]
+    assert len(players) >= 4 and len(set(player_names)) == len(players), 'Bad players'
+
+    recent = league_data.games[-recent_games:] if recent_games > 0 else []
+    played = {p.id: 0 for p in players}
+    for game in recent:
+        for p_id in game.player_ids:
+            if p_id in played:
+                played[p_id] += 1
+    by_rest = sorted(range(len(players)), key=lambda i: (played[players[i].id], i))
+    n_playing = len(players) - len(players) % 4
+    bench = [players[i] for i in sorted(by_rest[n_playing:])]
+    players = [players[i] for i in sorted(by_rest[:n_playing])]
+
+    index = {p.id: i for i, p in enumerate(players)}
+    partners = np.zeros((len(players), len(players)))
+    for game in recent:
+        for p1, p2 in (game.team1, game.team2):
+            if p1 in index and p2 in index:
+                partners[index[p1], index[p2]] += 1
+                partners[index[p2], index[p1]] += 1
+    ratings = np.array([(p.rating, p.rating_by_rounds) for p in players], dtype=float)
+
+    courts = []
+    for teams, cost in matchmaking.balanced_courts(ratings, partners, partner_penalty):
+        team1 = [players[i] for i in teams[:2]]
+        team2 = [players[i] for i in teams[2:]]
+        courts.append({
+            'team1': [p.name for p in team1],
+            'team2': [p.name for p in team2],
+            'expected_result': expected_result(
+                sum(p.rating for p in team1) / 2,
+                sum(p.rating for p in team2) / 2
+            ),
+            'expected_rounds_result': expected_result(
+                sum(p.rating_by_rounds for p in team1) / 2,
+                sum(p.rating_by_rounds for p in team2) / 2
+            ),
+            'recent_partners': int(partners[teams[0], teams[1]] + partners[teams[2], teams[3]]),
+            'imbalance': cost,
+        })
+    return {'courts': courts, 'bench': [p.name for p in bench]}
+
+
+def get_games_by_player_formatted(
+    player: Player,
+    before: tuple = None,
+    limit: int = None
+) -> List[dict]:
+    # Newest first, optionally keyset paginated like games_api_page
+    league_data = get_league()
+    players = league_data.players
     formatted_games = []
 
-    for game in games:
-        team1_names = [get_player_by_id(int(i)).name for i in game.team1.split(',')]
-        team2_names = [get_player_by_id(int(i)).name for i in game.team2.split(',')]
+    for game, team in league_data.newest_player_games(player.id, before, limit):
         formatted_game = {
-            'team1': ' / '.join(team1_names),
-            'team2': ' / '.join(team2_names),
-            'result': player_game_result(player, game),
-            'score': game.score.replace(',', '-'),
+            'team1': ' / '.join([players[i].name for i in game.team1]),
+            'team2': ' / '.join([players[i].name for i in game.team2]),
+            'result': game.result(team),
+            'score': '-'.join([str(s) for s in game.scores]),
+            'datetime': game.datetime,
+            'id': game.id,
         }
         formatted_games.append(formatted_game)
     return formatted_games
 
 
+def player_games_api_page(player: Player, before: tuple = None, limit: int = 50) -> dict:
+    games = get_games_by_player_formatted(player, before, limit)
+    next_cursor = None
+    if len(games) == limit:
+        next_cursor = f"{games[-1]['datetime']}:{games[-1]['id']}"
+    return {'games': games, 'next_cursor': next_cursor}
+
+
+def get_rating_history(player: Player, points: int = None) -> dict:
+    # Match and rounds rating after each game, oldest first, as [index,
+    # rating] pairs. With points both series are downsampled to about that
+    # many points with LTTB.
+    player = get_league().players[player.id]
+    history = [
+        game.ratings[game.player_ids.index(player.id)][:2]
+        for game in player.games
+    ]
+
+    elo_history = [(i, rating) for i, (rating, _) in enumerate(history)]
+    points_elo_history = [(i, rounds) for i, (_, rounds) in enumerate(history)]
+    if points is not None:
+        elo_history = lttb(elo_history, points)
+        points_elo_history = lttb(points_elo_history, points)
+
+    return {
+        'total': len(history),
+        'elo_history': elo_history,
+        'points_elo_history': points_elo_history,
+    }
+
+
+@cache.memoize(key=lambda player: player.id)
 def get_player_stats(player: Player) -> dict:
-    stats = {
-        'won_games': 0,
-        'lost_games': 0,
-        'total_games': 0,
-        'won_rounds': 0,
-        'lost_rounds': 0,
-        'total_rounds': 0,
-        'win_perc': 0,
-        'round_win_perc': 0,
-        'last_5_games': [],
-        'rank': get_player_rank(player),
-        'elo_history': [],
-        'points_elo_history': [],
+    player = get_league().players[player.id]
+    total_games = player.won_games + player.lost_games
+    total_rounds = player.won_rounds + player.lost_rounds
+    return {
+        'won_games': player.won_games,
+        'lost_games': player.lost_games,
+        'total_games': total_games,
+        'won_rounds': player.won_rounds,
+        'lost_rounds': player.lost_rounds,
+        'total_rounds': total_rounds,
+        'win_perc': player.won_games / total_games * 100 if total_games else 0,
+        'round_win_perc': player.won_rounds / total_rounds * 100 if total_rounds else 0,
+        'last_5_games': [result == '+' for result in player.last_games],
+        'rank': player.rank,
     }
 
-    player_history = get_history_entries_by_player_id(player.id)
-    history_ordered = sorted(player_history, key=lambda e: int(e.datetime), reverse=True)
-    for entry in player_history:
-        stats['elo_history'].append(entry.rating)
-        stats['points_elo_history'].append(entry.rating_by_rounds)
 
-    player_games = get_games_by_player(player)
+@cache.memoize()
+def games_table_data(limit: int = None, offset: int = 0) -> List[dict]:
+    # Newest games first
+    return format_games_table(get_league().newest_games(limit=limit, offset=offset))
+
 
-    for game in player_games:
-        player_in_team1 = str(player.id) in game.team1
-        team1_score, team2_score = [int(s) for s in game.score.split(',')]
-        team1_won = team1_score > team2_score
+def games_api_page(before: tuple = None, limit: int = 50) -> dict:
+    # Keyset paginated games, newest first. before is the (datetime, id)
+    # cursor returned with the previous page.
+    games = get_league().newest_games(before, limit)
+    return {
+        'games': format_games_table(games),
+        'next_cursor': page_cursor(games, limit),
+    }
 
-        stats['won_rounds'] += team1_score if player_in_team1 else team2_score
-        stats['lost_rounds'] += team2_score if player_in_team1 else team1_score
-        stats['total_games'] += 1
-        stats['total_rounds'] += team1_score + team2_score
 
-        if team1_won:
-            stats['won_games'] += int(player_in_team1)
-            stats['lost_games'] += int(not player_in_team1)
-            stats['last_5_games'].append(player_in_team1)
-        else:
-            stats['won_games'] += int(not player_in_team1)
-            stats['lost_games'] += int(player_in_team1)
-            stats['last_5_games'].append(not player_in_team1)
+def page_cursor(games: List[GameRecord], limit: int) -> Union[str, None]:
+    if len(games) < limit:
+        return None
+    return f'{games[-1].datetime}:{games[-1].id}'
 
-        if len(stats['last_5_games']) > 5:
-            stats['last_5_games'].pop(0)
 
+def parse_page_cursor(cursor: str) -> Union[tuple, None]:
     try:
-        stats['win_perc'] = stats['won_games'] / stats['total_games'] * 100
-        stats['round_win_perc'] = stats['won_rounds'] / stats['total_rounds'] * 100
-    except ZeroDivisionError:
-        stats['win_perc'] = 0
-        stats['round_win_perc'] = 0
-
-    return stats
+        game_datetime, game_id = cursor.split(':')
+        return int(game_datetime), int(game_id)
+    except (AttributeError, ValueError):
+        return None
 
 
-def games_table_data() -> dict:
+def format_games_table(games: List[GameRecord]) -> List[dict]:
+    players = get_league().players
     table_data = []
-    games = sorted(get_all_games(), key=lambda g: int(g.datetime), reverse=True)
-
     for game in games:
-        readable_datetime = time.strftime('%d.%m.%Y', time.localtime(int(game.datetime)))
-        t1score, t2score = game.score.split(',')
+        readable_datetime = time.strftime('%d.%m.%Y', time.localtime(game.datetime))
+        t1score, t2score = game.scores
 
         game_data = {
             'datetime': readable_datetime,
-            'team1score': t1score,
-            'team2score': t2score,
+            'team1score': str(t1score),
+            'team2score': str(t2score),
             'id': game.id,
             'players': [],
         }
 
-        player_ids_str = game.team1.split(',') + game.team2.split(',')
-        player_ids = [int(p_id) for p_id in player_ids_str]
-        players = [get_player_by_id(p_id) for p_id in player_ids]
-
-        for player in players:
-            player_history_entry = get_history_entry_by_player_and_game(
-                player.id,
-                game.id
-            )
-
+        for player_id, (_, _, rating_diff, rounds_rating_diff) in zip(game.player_ids, game.ratings):
             game_data['players'].append({
-                'name': player.name,
-                'rating_diff': f'{player_history_entry.rating_diff:+g}',
-                'rounds_rating_diff': f'{player_history_entry.rounds_rating_diff:+g}'
+                'name': players[player_id].name,
+                'rating_diff': f'{rating_diff:+g}',
+                'rounds_rating_diff': f'{rounds_rating_diff:+g}'
             })
 
         table_data.append(game_data)
@@ -400,56 +922,158 @@ def games_table_data() -> dict:
     return table_data
 
 
+def count_games() -> int:
+    return len(get_league().games)
+
+
+@cache.memoize()
 def players_table_data() -> dict:
     table_data = []
-    players = sorted(get_all_players(), key=lambda p: p.rating, reverse=True)
+    players = sorted(get_league().players.values(), key=lambda p: (-p.rating, p.id))
 
     for player in players:
-        player_stats = get_player_stats(player)
+        total_games = player.won_games + player.lost_games
+        total_rounds = player.won_rounds + player.lost_rounds
         table_data.append({
             'name': player.name,
             'rating': player.rating,
             'rounds_rating': player.rating_by_rounds,
-            'win_perc': int(player_stats['win_perc']),
-            'round_win_perc': int(player_stats['round_win_perc']),
-            'last_games': player_stats['last_5_games'],
+            'win_perc': int(player.won_games / total_games * 100) if total_games else 0,
+            'round_win_perc': int(player.won_rounds / total_rounds * 100) if total_rounds else 0,
+            'last_games': [result == '+' for result in player.last_games],
         })
 
     return table_data
 
 
-def create_backup() -> str:
-    games_text = ''
-    games = get_all_games()
-    for game in games:
-        p1, p2 = [get_player_by_id(int(p)).name for p in game.team1.split(',')]
-        p3, p4 = [get_player_by_id(int(p)).name for p in game.team2.split(',')]
-        t1score, t2score = game.score.split(',')
-        games_text += f'{p1},{p2},{p3},{p4},{t1score},{t2score},{game.datetime}\n'
-    return games_text
-
-
-def load_from_backup(backup_data) -> None:
-    game_strings = backup_data.read().decode('UTF-8').split('\n')
-    games = [game.split(',') for game in game_strings if game != '']
-    for game_data in games:
-        # format: ['Aleksi', 'Aki', 'Saku', 'Repa', '5', '6', '1643569200']
-        assert len(game_data) == 7, 'Bad game data'
-        team1 = game_data[0:2]
-        team2 = game_data[2:4]
-        for player_name in team1 + team2:
-            if get_player_by_name(player_name) is not None:
+def create_backup(since: int = None) -> str:
+    return ''.join(iter_backup_chunks(since))
+
+
+def iter_backup_chunks(since: int = None):
+    # Yields the backup text in chunks of EXPORT_BATCH_SIZE games so the
+    # whole history never has to be held in memory. With since only games
+    # played after that timestamp are included.
+    names = dict(db.session.query(Player.id, Player.name))
+    games = db.session.query(
+        Game.team1,
+        Game.team2,
+        Game.score,
+        Game.datetime
+    ).order_by(Game.id)
+    if since is not None:
+        games = games.filter(Game.datetime > since)
+
+    lines = []
+    for team1, team2, score, datetime in games.yield_per(EXPORT_BATCH_SIZE):
+        p1, p2 = [names[int(p)] for p in team1.split(',')]
+        p3, p4 = [names[int(p)] for p in team2.split(',')]
+        t1score, t2score = score.split(',')
+        lines.append(f'{p1},{p2},{p3},{p4},{t1score},{t2score},{datetime}\n')
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def load_from_backup(backup_data, progress=None) -> dict:
+    # Streams a backup made by create_backup into the database in one
+    # transaction and rates the imported games once at the end. Lines that
+    # can't be parsed are skipped and reported by line number.
+    started = time.time()
+    name_to_id = dict(db.session.query(Player.name, Player.id))
+    next_player_id = (db.session.query(db.func.max(Player.id)).scalar() or 0) + 1
+    next_game_id = (db.session.query(db.func.max(Game.id)).scalar() or 0) + 1
+
+    new_players = []
+    new_games = []
+    new_participants = []
+    malformed_lines = []
+    imported_games = 0
+    imported_players = 0
+    earliest_datetime = None
+
+    for line_number, line in enumerate(backup_data, start=1):
+        # format: Aleksi,Aki,Saku,Repa,5,6,1643569200
+        try:
+            game_data = line.decode('UTF-8').strip().split(',')
+            if game_data == ['']:
                 continue
-            add_player(player_name)
+            assert len(game_data) == 7, 'Bad game data'
+            names = game_data[0:4]
+            assert '' not in names and len(set(names)) == 4, 'Bad players'
+            score = [int(game_data[4]), int(game_data[5])]
+            game_datetime = int(game_data[6])
+        except (UnicodeDecodeError, AssertionError, ValueError):
+            malformed_lines.append(line_number)
+            continue
+
+        for player_name in names:
+            if player_name in name_to_id:
+                continue
+            name_to_id[player_name] = next_player_id
+            new_players.append({
+                'id': next_player_id,
+                'name': player_name,
+                'rating': START_RATING,
+                'rating_by_rounds': START_RATING,
+            })
+            next_player_id += 1
+            imported_players += 1
+
+        player_ids = [name_to_id[name] for name in names]
+        new_games.append({
+            'id': next_game_id,
+            'team1': ','.join([str(i) for i in player_ids[0:2]]),
+            'team2': ','.join([str(i) for i in player_ids[2:4]]),
+            'score': ','.join([str(s) for s in score]),
+            'datetime': game_datetime,
+        })
+        for team, team_ids in ((1, player_ids[0:2]), (2, player_ids[2:4])):
+            for p_id in team_ids:
+                new_participants.append({'game_id': next_game_id, 'player_id': p_id, 'team': team})
+        next_game_id += 1
+        imported_games += 1
+        if earliest_datetime is None or game_datetime < earliest_datetime:
+            earliest_datetime = game_datetime
+
+        if len(new_games) >= IMPORT_BATCH_SIZE:
+            db.session.bulk_insert_mappings(Player, new_players)
+            db.session.bulk_insert_mappings(Game, new_games)
+            db.session.bulk_insert_mappings(GameParticipant, new_participants)
+            new_players = []
+            new_games = []
+            new_participants = []
+            if progress is not None:
+                progress('importing games', imported_games)
+
+    db.session.bulk_insert_mappings(Player, new_players)
+    db.session.bulk_insert_mappings(Game, new_games)
+    db.session.bulk_insert_mappings(GameParticipant, new_participants)
+    rebuild_player_stats()
+    changes.record(changes.ALL)
+    if earliest_datetime is not None:
+        replay_ratings_from(earliest_datetime, progress)
+    db.session.commit()
+    avatars.pregenerate(name_to_id)
 
-        score = [int(game_data[4]), int(game_data[5])]
-        team1_ids = [get_player_by_name(p).id for p in team1]
-        team2_ids = [get_player_by_name(p).id for p in team2]
-        add_game(team1_ids, team2_ids, score, datetime=game_data[6])
+    elapsed = time.time() - started
+    return {
+        'imported_games': imported_games,
+        'imported_players': imported_players,
+        'malformed_lines': malformed_lines,
+        'seconds': elapsed,
+        'rows_per_sec': imported_games / elapsed if elapsed > 0 else 0,
+    }
 
 
 def clear_database() -> None:
     Game.query.delete()
+    GameParticipant.query.delete()
     Player.query.delete()
+    PlayerStats.query.delete()
     RatingHistory.query.delete()
+    RatingSnapshot.query.delete()
+    changes.record(changes.ALL)
     db.session.commit()
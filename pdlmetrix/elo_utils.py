@@ -1,5 +1,10 @@
-def expected_result(p1, p2):
-    return 1 / (1 + 10 ** ((p2 - p1) / 400))
+K_FACTOR = 32
+SCALE = 400 # rating difference at which the stronger side is 10x as likely to win
+START_RATING = 1000
+
+
+def expected_result(p1, p2, scale=SCALE):
+    return 1 / (1 + 10 ** ((p2 - p1) / scale))
 
 def result(p1, p2, raw_result=True):
     if p1 == p2:
@@ -8,8 +13,15 @@ def result(p1, p2, raw_result=True):
         return int(p1 > p2)
     return 1 / (p1 + p2) * p1
 
-def modified_elo(player_elo, opponent_elo, p_points, o_points, raw_result=True):
-    K = 32
-    exp_res = expected_result(player_elo, opponent_elo)
+def modified_elo(
+    player_elo,
+    opponent_elo,
+    p_points,
+    o_points,
+    raw_result=True,
+    K=K_FACTOR,
+    scale=SCALE
+):
+    exp_res = expected_result(player_elo, opponent_elo, scale)
     res = result(p_points, o_points, raw_result=raw_result)
     return int(player_elo + K * (res - exp_res))
@@ -0,0 +1,303 @@
+# Long admin operations (removing or editing games, loading backups,
+# clearing the database) run as background jobs instead of inside the
+# request. Jobs are kept in the padelJobs table of the jobs database, which
+# is separate from the league database so progress can be written and read
+# while a job holds the league database's write lock.
+#
+# Every worker process runs one runner thread, and a job is only claimed
+# when no other job is running in any process, so two rating rebuilds can
+# never interleave. A running job whose heartbeat stops (its process died)
+# is picked up again after STALE_SECONDS.
+import gzip
+import json
+import os
+import threading
+import time
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+from . import db
+from .models import Job
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+POLL_SECONDS = 1
+HEARTBEAT_SECONDS = 1
+STALE_SECONDS = 30
+
+_handlers = {}
+_runner = None
+_runner_pid = None
+_wake_up = threading.Event()
+_lock = threading.Lock()
+
+
+def handler(kind: str):
+    # Registers func(progress, **arguments) -> result as the job kind
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def jobs_table():
+    return Job.__table__
+
+
+def jobs_engine():
+    return db.get_engine(bind='jobs')
+
+
+def enqueue(kind: str, arguments: dict = None) -> int:
+    assert kind in _handlers, f'Unknown job kind {kind}'
+    with jobs_engine().begin() as connection:
+        job_id = connection.execute(jobs_table().insert().values(
+            kind=kind,
+            status=QUEUED,
+            arguments=json.dumps(arguments or {}),
+            processed=0,
+            created=time.time(),
+        )).inserted_primary_key[0]
+    if not current_app.config['JOBS_ENABLED']:
+        # Left for another worker sharing the jobs database
+        current_app.logger.warning('job %s (%s) queued with JOBS_ENABLED off', job_id, kind)
+    ensure_runner(current_app._get_current_object())
+    _wake_up.set()
+    return job_id
+
+
+def get_job(job_id: int) -> dict:
+    with jobs_engine().connect() as connection:
+        job = connection.execute(
+            jobs_table().select().where(jobs_table().c.id == job_id)
+        ).first()
+    if job is None:
+        return None
+    return job_status(job)
+
+
+def recent_jobs(limit: int = 10) -> list:
+    with jobs_engine().connect() as connection:
+        jobs = connection.execute(
+            jobs_table().select().order_by(jobs_table().c.id.desc()).limit(limit)
+        ).all()
+    return [job_status(job) for job in jobs]
+
+
+def job_status(job) -> dict:
+    rate = None
+    eta_seconds = None
+    if job.status == RUNNING and job.stage_started and job.heartbeat > job.stage_started:
+        rate = job.processed / (job.heartbeat - job.stage_started)
+        if job.total and rate > 0:
+            eta_seconds = (job.total - job.processed) / rate
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'stage': job.stage,
+        'processed': job.processed,
+        'total': job.total,
+        'rate': rate,
+        'eta_seconds': eta_seconds,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'created': job.created,
+        'started': job.started,
+        'finished': job.finished,
+    }
+
+
+def ensure_runner(app) -> None:
+    # Starts the runner thread of this process, again after a fork
+    global _runner, _runner_pid
+    if not app.config['JOBS_ENABLED']:
+        return
+    with _lock:
+        if _runner is not None and _runner.is_alive() and _runner_pid == os.getpid():
+            return
+        _runner = threading.Thread(target=run, args=(app,), name='pdlmetrix-jobs', daemon=True)
+        _runner_pid = os.getpid()
+        _runner.start()
+
+
+def run(app) -> None:
+    while True:
+        _wake_up.wait(POLL_SECONDS)
+        _wake_up.clear()
+        with app.app_context():
+            try:
+                while run_next_job(app):
+                    pass
+            except Exception:
+                # Most likely a locked jobs database, queued jobs are
+                # picked up again on the next poll
+                app.logger.exception('job runner failed')
+            finally:
+                db.session.remove()
+
+
+def claim_next_job():
+    jobs = jobs_table()
+    now = time.time()
+    stale = jobs.c.heartbeat < now - STALE_SECONDS
+    with jobs_engine().begin() as connection:
+        job = connection.execute(
+            jobs.select().where(db.or_(
+                jobs.c.status == QUEUED,
+                db.and_(jobs.c.status == RUNNING, stale)
+            )).order_by(jobs.c.id).limit(1)
+        ).first()
+        if job is None:
+            return None
+        # A single statement so only one process can win the job, and only
+        # while nothing else is running
+        others = jobs.alias('others')
+        other_running = db.exists().where(
+            others.c.status == RUNNING,
+            others.c.id != job.id,
+            others.c.heartbeat >= now - STALE_SECONDS
+        )
+        claimed = connection.execute(jobs.update().where(
+            jobs.c.id == job.id,
+            jobs.c.status == job.status,
+            db.not_(other_running)
+        ).values(
+            status=RUNNING,
+            started=now,
+            heartbeat=now,
+            stage=None,
+            processed=0,
+            total=None,
+        )).rowcount
+    return job if claimed else None
+
+
+def run_next_job(app) -> bool:
+    job = claim_next_job()
+    if job is None:
+        return False
+
+    progress = Progress(job.id, jobs_engine())
+    progress.start()
+    try:
+        result = _handlers[job.kind](progress, **json.loads(job.arguments))
+        status, error = DONE, None
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception('job %s (%s) failed', job.id, job.kind)
+        result, status, error = None, FAILED, repr(e)
+    finally:
+        progress.stop()
+        db.session.remove()
+
+    values = {
+        'status': status,
+        'result': json.dumps(result) if result is not None else None,
+        'error': error,
+        'processed': progress.processed,
+        'total': progress.total,
+    }
+    # A finished job left running would be run again once it goes stale
+    deadline = time.time() + STALE_SECONDS / 2
+    while True:
+        try:
+            with jobs_engine().begin() as connection:
+                connection.execute(
+                    jobs_table().update().where(jobs_table().c.id == job.id).values(
+                        heartbeat=time.time(),
+                        finished=time.time(),
+                        **values
+                    )
+                )
+            return True
+        except OperationalError:
+            if time.time() > deadline:
+                raise
+            time.sleep(POLL_SECONDS)
+
+
+class Progress:
+    # Called by the job as progress(stage, processed, total=None). Values are
+    # kept in memory and written to the job row with the heartbeat.
+    def __init__(self, job_id: int, engine):
+        self.job_id = job_id
+        self.engine = engine
+        self.stage = None
+        self.processed = 0
+        self.total = None
+        self.stage_started = time.time()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def __call__(self, stage: str, processed: int, total: int = None) -> None:
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_started = time.time()
+        self.processed = processed
+        self.total = total
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _beat(self) -> None:
+        while not self._stopped.wait(HEARTBEAT_SECONDS):
+            try:
+                self._write()
+            except OperationalError:
+                pass # locked, try again on the next beat
+
+    def _write(self) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(
+                jobs_table().update().where(jobs_table().c.id == self.job_id).values(
+                    stage=self.stage,
+                    processed=self.processed,
+                    total=self.total,
+                    stage_started=self.stage_started,
+                    heartbeat=time.time(),
+                )
+            )
+
+
+@handler('remove_game')
+def remove_game(progress, game_id: int) -> None:
+    from . import databaseManager as DbManager
+    DbManager.remove_game(game_id, progress)
+
+
+@handler('edit_game_score')
+def edit_game_score(progress, game_id: int, scores: list) -> None:
+    from . import databaseManager as DbManager
+    DbManager.edit_game_score(game_id, scores, progress)
+
+
+@handler('load_from_backup')
+def load_from_backup(progress, path: str, gzipped: bool) -> dict:
+    # path is the uploaded backup spooled to disk, removed once imported
+    from . import databaseManager as DbManager
+    try:
+        with (gzip.open if gzipped else open)(path, 'rb') as backup_file:
+            report = DbManager.load_from_backup(backup_file, progress)
+    finally:
+        os.remove(path)
+    current_app.logger.info(
+        'load_from_backup: imported %s games and %s new players in %.2fs (%.0f rows/s)',
+        report['imported_games'],
+        report['imported_players'],
+        report['seconds'],
+        report['rows_per_sec'],
+    )
+    return report
+
+
+@handler('clear_database')
+def clear_database(progress) -> None:
+    from . import databaseManager as DbManager
+    DbManager.clear_database()
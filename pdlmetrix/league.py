@@ -0,0 +1,122 @@
+# Read-only in-memory copy of the league that the public pages are computed
+# from. Rows are parsed once into slotted records when it's built, and it is
+# rebuilt lazily after any write (see changes.py).
+import threading
+from typing import List, Tuple
+
+
+class GameRecord:
+    __slots__ = ('id', 'team1', 'team2', 'scores', 'datetime', 'ratings')
+
+    def __init__(self, game_id: int, team1: tuple, team2: tuple, scores: tuple, datetime: int):
+        self.id = game_id
+        self.team1 = team1
+        self.team2 = team2
+        self.scores = scores
+        self.datetime = datetime
+        # (rating, rating_by_rounds, rating_diff, rounds_rating_diff) after
+        # the game of each player, in team1 + team2 order
+        self.ratings = ()
+
+    @property
+    def player_ids(self) -> tuple:
+        return self.team1 + self.team2
+
+    def result(self, team: int) -> int:
+        # 0=loss, 1=tie, 2=win for the given team (1 or 2)
+        t1s, t2s = self.scores
+        if t1s == t2s:
+            return 1
+        return 2 if (t1s > t2s) == (team == 1) else 0
+
+
+class PlayerRecord:
+    __slots__ = (
+        'id', 'name', 'rating', 'rating_by_rounds', 'won_games', 'lost_games',
+        'won_rounds', 'lost_rounds', 'last_games', 'rank', 'games', 'teams'
+    )
+
+    def __init__(self, player, stats):
+        self.id = player.id
+        self.name = player.name
+        self.rating = player.rating
+        self.rating_by_rounds = player.rating_by_rounds
+        self.won_games = stats.won_games
+        self.lost_games = stats.lost_games
+        self.won_rounds = stats.won_rounds
+        self.lost_rounds = stats.lost_rounds
+        self.last_games = stats.last_games
+        self.rank = stats.rank
+        self.games = [] # oldest first
+        self.teams = [] # 1 or 2 in each of games
+
+
+class League:
+    __slots__ = ('games', 'players', 'players_by_name', 'version')
+
+    def __init__(self, games: List[GameRecord], players: List[PlayerRecord], version: int = 0):
+        self.games = games # oldest first
+        self.version = version # latest change log entry it includes
+        self.players = {p.id: p for p in players}
+        self.players_by_name = {p.name: p for p in players}
+        for game in games:
+            for team, team_ids in ((1, game.team1), (2, game.team2)):
+                for p_id in team_ids:
+                    self.players[p_id].games.append(game)
+                    self.players[p_id].teams.append(team)
+
+    def newest_games(
+        self,
+        before: Tuple[int, int] = None,
+        limit: int = None,
+        offset: int = 0
+    ) -> List[GameRecord]:
+        # Newest first, only games played before the (datetime, id) position
+        end = len(self.games) if before is None else games_before(self.games, before)
+        end = max(end - offset, 0)
+        start = 0 if limit is None else max(end - limit, 0)
+        return self.games[start:end][::-1]
+
+    def newest_player_games(
+        self,
+        player_id: int,
+        before: Tuple[int, int] = None,
+        limit: int = None
+    ) -> List[tuple]:
+        # (game, team) pairs newest first like newest_games
+        player = self.players[player_id]
+        end = len(player.games) if before is None else games_before(player.games, before)
+        start = 0 if limit is None else max(end - limit, 0)
+        return list(zip(player.games[start:end], player.teams[start:end]))[::-1]
+
+
+def games_before(games: List[GameRecord], position: Tuple[int, int]) -> int:
+    # Binary search for the number of games played before position
+    low, high = 0, len(games)
+    while low < high:
+        middle = (low + high) // 2
+        if (games[middle].datetime, games[middle].id) < position:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+_league = None
+_lock = threading.Lock()
+
+
+def get_league(load_league) -> League:
+    # Returns the league, building it with load_league() the first time or
+    # after invalidate()
+    global _league
+    with _lock:
+        if _league is None:
+            _league = load_league()
+        return _league
+
+
+def invalidate() -> None:
+    global _league
+    with _lock:
+        _league = None
@@ -0,0 +1,41 @@
+# Largest-Triangle-Three-Buckets downsampling for line charts: keeps the
+# first and last point and from every bucket in between the point forming
+# the largest triangle with the previously kept point and the next bucket's
+# average, which preserves the visual shape of the series.
+from typing import List, Sequence, Tuple
+
+Point = Tuple[float, float]
+
+
+def lttb(points: Sequence[Point], threshold: int) -> List[Point]:
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    kept = 0
+
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        next_start = end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(points))
+        next_bucket = points[next_start:next_end]
+        avg_x = sum([p[0] for p in next_bucket]) / len(next_bucket)
+        avg_y = sum([p[1] for p in next_bucket]) / len(next_bucket)
+
+        kept_x, kept_y = points[kept]
+        best_area = -1
+        for i in range(start, end):
+            x, y = points[i]
+            area = abs((kept_x - avg_x) * (y - kept_y) - (kept_x - x) * (avg_y - kept_y))
+            if area > best_area:
+                best_area = area
+                best = i
+
+        sampled.append(points[best])
+        kept = best
+
+    sampled.append(points[-1])
+    return sampled
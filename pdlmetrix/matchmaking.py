@@ -0,0 +1,137 @@
+# Splits the players present into balanced 2v2 games, one per court. A
+# game's imbalance is how far the expected result of its team averages is
+# from 0.5, for both the match and the rounds rating, plus a penalty for
+# each pair of partners who recently played together. The courts are
+# seeded greedily from the cheapest groups of four and then improved by
+# re-splitting the players of every pair of courts exhaustively until no
+# exchange helps. Smaller pools also re-split every three courts, which
+# makes the result optimal for up to three courts. Candidate groups are
+# always scored as whole arrays.
+import itertools
+from typing import List, Tuple
+import numpy as np
+from .elo_utils import SCALE
+
+# Larger pools skip scoring every group of four when seeding
+MAX_ENUMERATED_PLAYERS = 40
+MAX_ROUNDS = 50
+# Three court exchanges score 5775 splits each, only tried up to this many
+MAX_TRIPLE_EXCHANGE_COURTS = 5
+
+# The three ways to split players 0..3 of a group into two teams
+_SPLITS = np.array([
+    [0, 1, 2, 3],
+    [0, 2, 1, 3],
+    [0, 3, 1, 2],
+])
+
+
+def _partitions(players: List[int]) -> List[List[int]]:
+    # Every way to split players into groups of four, groups concatenated
+    if not players:
+        return [[]]
+    first, rest = players[0], players[1:]
+    partitions = []
+    for others in itertools.combinations(rest, 3):
+        remaining = [p for p in rest if p not in others]
+        for partition in _partitions(remaining):
+            partitions.append([first, *others, *partition])
+    return partitions
+
+
+# Ways to split the players of two (35) or three (5775) courts
+_EXCHANGES = {
+    courts: np.array(_partitions(list(range(4 * courts))))
+    for courts in (2, 3)
+}
+
+
+def imbalance(expected: np.ndarray) -> np.ndarray:
+    return np.abs(expected - 0.5)
+
+
+def group_costs(
+    groups: np.ndarray,
+    ratings: np.ndarray,
+    partners: np.ndarray,
+    partner_penalty: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns the cost of the best split of each group of four player
+    # indexes and that split as [team1, team1, team2, team2] indexes
+    teams = groups[:, _SPLITS] # (groups, splits, 4)
+    team_ratings = ratings[teams] # (groups, splits, 4, 2)
+    team1 = team_ratings[:, :, :2].mean(axis=2)
+    team2 = team_ratings[:, :, 2:].mean(axis=2)
+    expected = 1 / (1 + 10 ** ((team2 - team1) / SCALE))
+    costs = imbalance(expected).sum(axis=2)
+    costs += partner_penalty * (
+        partners[teams[:, :, 0], teams[:, :, 1]] + partners[teams[:, :, 2], teams[:, :, 3]]
+    )
+    best = costs.argmin(axis=1)
+    rows = np.arange(len(groups))
+    return costs[rows, best], teams[rows, best]
+
+
+def seed_courts(ratings: np.ndarray, partners: np.ndarray, partner_penalty: float) -> List[np.ndarray]:
+    n = len(ratings)
+    if n > MAX_ENUMERATED_PLAYERS:
+        # Neighbours in the ranking share a court
+        order = np.argsort(-ratings.sum(axis=1), kind='stable')
+        return [order[i:i + 4] for i in range(0, n, 4)]
+
+    groups = np.array(list(itertools.combinations(range(n), 4)))
+    costs, _ = group_costs(groups, ratings, partners, partner_penalty)
+    used = np.zeros(n, dtype=bool)
+    courts = []
+    for group in groups[np.argsort(costs, kind='stable')]:
+        if not used[group].any():
+            used[group] = True
+            courts.append(group)
+            if len(courts) == n // 4:
+                break
+    return courts
+
+
+def balanced_courts(
+    ratings: np.ndarray,
+    partners: np.ndarray,
+    partner_penalty: float = 0.0
+) -> List[Tuple[np.ndarray, float]]:
+    # ratings is (n, 2) match and rounds ratings with n a multiple of 4,
+    # partners (n, n) recent partnership counts. Returns ([team1, team1,
+    # team2, team2] player indexes, cost) per court.
+    assert len(ratings) % 4 == 0, 'Players must fill the courts'
+    courts = seed_courts(ratings, partners, partner_penalty)
+    costs, _ = group_costs(np.array(courts), ratings, partners, partner_penalty)
+    costs = list(costs)
+
+    def exchange(court_indexes) -> bool:
+        # Re-splits the players of the given courts in the best way
+        size = len(court_indexes)
+        players = np.concatenate([courts[i] for i in court_indexes])
+        candidates = players[_EXCHANGES[size]].reshape(-1, 4)
+        candidate_costs, _ = group_costs(candidates, ratings, partners, partner_penalty)
+        candidate_costs = candidate_costs.reshape(-1, size)
+        best = int(candidate_costs.sum(axis=1).argmin())
+        if candidate_costs[best].sum() >= sum(costs[i] for i in court_indexes) - 1e-12:
+            return False
+        for k, i in enumerate(court_indexes):
+            courts[i] = candidates[best * size + k]
+            costs[i] = candidate_costs[best, k]
+        return True
+
+    sizes = (2, 3) if len(courts) <= MAX_TRIPLE_EXCHANGE_COURTS else (2,)
+    for size in sizes:
+        for _ in range(MAX_ROUNDS):
+            improved = False
+            for court_indexes in itertools.combinations(range(len(courts)), size):
+                improved |= exchange(court_indexes)
+            # Pairs are cheap, so they are settled again before more triples
+            for court_indexes in itertools.combinations(range(len(courts)), 2):
+                improved |= exchange(court_indexes)
+            if not improved:
+                break
+
+    _, splits = group_costs(np.array(courts), ratings, partners, partner_penalty)
+    order = np.argsort(-ratings[splits].sum(axis=(1, 2)), kind='stable')
+    return [(splits[k], float(costs[k])) for k in order]
@@ -0,0 +1,224 @@
+# Optional request, SQL and databaseManager instrumentation.
+#
+# Enabled with the METRICS_ENABLED config value (or PDLMETRIX_METRICS_ENABLED=1
+# in the environment). When disabled nothing is hooked at all. When enabled it
+# records per route and per databaseManager function latency histograms,
+# SQL statement, fetched row and commit counts, and exposes them in the
+# Prometheus text format at /metrics behind the admin login. Requests slower
+# than METRICS_SLOW_REQUEST_SECONDS are logged with their slowest statements.
+import threading
+import time
+from functools import wraps
+from types import FunctionType
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+SLOW_REQUEST_STATEMENTS = 5
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {} # name: {labels: Histogram}
+        self.counters = {} # name: {labels: value}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, labels: tuple, value, buckets=LATENCY_BUCKETS) -> None:
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if labels not in series:
+                series[labels] = Histogram(buckets)
+            series[labels].observe(value)
+
+    def inc(self, name: str, labels: tuple = (), value=1) -> None:
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f'# HELP {name} {self.help.get(name, name)}')
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{name}{_labels(labels)} {value}')
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f'# HELP {name} {self.help.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket_labels = labels + (('le', str(bound)),)
+                        lines.append(f'{name}_bucket{_labels(bucket_labels)} {count}')
+                    inf_labels = labels + (('le', '+Inf'),)
+                    lines.append(f'{name}_bucket{_labels(inf_labels)} {histogram.count}')
+                    lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = [
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    ]
+    return '{' + ','.join([f'{key}="{value}"' for key, value in escaped]) + '}'
+
+
+registry = Registry()
+registry.help.update({
+    'pdlmetrix_request_seconds': 'Request latency by endpoint',
+    'pdlmetrix_request_queries': 'SQL statements per request by endpoint',
+    'pdlmetrix_db_function_seconds': 'databaseManager function latency',
+    'pdlmetrix_sql_statements_total': 'SQL statements executed',
+    'pdlmetrix_sql_seconds_total': 'Time spent executing SQL statements',
+    'pdlmetrix_sql_rows_total': 'Rows reported by the DBAPI cursor (affected by writes)',
+    'pdlmetrix_sql_rows_fetched_total': 'Rows fetched from query results',
+    'pdlmetrix_commits_total': 'Committed transactions',
+})
+
+
+def init_app(app, db, auth, db_manager) -> None:
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    slow_request_seconds = app.config['METRICS_SLOW_REQUEST_SECONDS']
+    _hook_sql(db.engine)
+    _wrap_functions(db_manager)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_statements = []
+
+    @app.teardown_request
+    def record_request(exc=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unknown'
+        registry.observe('pdlmetrix_request_seconds', (('endpoint', endpoint),), elapsed)
+        registry.observe(
+            'pdlmetrix_request_queries',
+            (('endpoint', endpoint),),
+            g.metrics_queries,
+            QUERY_COUNT_BUCKETS
+        )
+        if slow_request_seconds and elapsed >= slow_request_seconds:
+            slowest = sorted(g.metrics_statements, reverse=True)[:SLOW_REQUEST_STATEMENTS]
+            app.logger.warning(
+                'slow request %s %s: %.3fs, %d queries%s',
+                request.method,
+                request.path,
+                elapsed,
+                g.metrics_queries,
+                ''.join([f'\n  {seconds:.4f}s {statement}' for seconds, statement in slowest])
+            )
+
+    @auth.login_required
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+class CountingCursor:
+    # Wraps a DBAPI cursor and counts the rows fetched through it, as
+    # cursor.rowcount is -1 for SELECTs on SQLite
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            registry.inc('pdlmetrix_sql_rows_fetched_total')
+            yield row
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            registry.inc('pdlmetrix_sql_rows_fetched_total')
+        return row
+
+    def fetchmany(self, *args):
+        return self._counted(self._cursor.fetchmany(*args))
+
+    def fetchall(self):
+        return self._counted(self._cursor.fetchall())
+
+    def _counted(self, rows):
+        if rows:
+            registry.inc('pdlmetrix_sql_rows_fetched_total', value=len(rows))
+        return rows
+
+
+def _hook_sql(engine) -> None:
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        registry.inc('pdlmetrix_sql_statements_total')
+        registry.inc('pdlmetrix_sql_seconds_total', value=elapsed)
+        if cursor.rowcount > 0:
+            registry.inc('pdlmetrix_sql_rows_total', value=cursor.rowcount)
+        if context is not None and cursor.description is not None:
+            # The result is built from context.cursor right after this event
+            context.cursor = CountingCursor(cursor)
+        if has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+            g.metrics_statements.append((elapsed, statement))
+
+    @event.listens_for(engine, 'commit')
+    def commit(conn):
+        registry.inc('pdlmetrix_commits_total')
+
+
+def _wrap_functions(module) -> None:
+    # Replaces the module's public functions with timed versions. Module
+    # globals are its attributes, so calls inside the module are timed too.
+    for name, func in list(vars(module).items()):
+        if name.startswith('_') or not isinstance(func, FunctionType):
+            continue
+        if func.__module__ != module.__name__ or hasattr(func, 'metrics_timed'):
+            continue
+        setattr(module, name, _timed(func))
+
+
+def _timed(func):
+    labels = (('function', func.__name__),)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registry.observe('pdlmetrix_db_function_seconds', labels, time.perf_counter() - started)
+    wrapper.metrics_timed = True
+    return wrapper
@@ -0,0 +1,115 @@
+# db.create_all only creates missing tables, so schema changes to tables
+# of existing databases are made here. Migrations run once each, in order,
+# and the number of applied migrations is stored in schemaVersion.
+from sqlalchemy import inspect
+from . import db
+from .models import Player, PlayerStats, Game, GameParticipant, RatingHistory, User, SchemaVersion
+from .databaseManager import rebuild_player_stats, rebuild_rating_snapshots
+
+# Rows that would break a new unique constraint, only the oldest is kept
+UNIQUE_KEYS = {
+    RatingHistory: 'player_id, game_id',
+    User: 'username',
+}
+
+
+def upgrade() -> None:
+    existing_database = inspect(db.engine).has_table(Game.__tablename__)
+    db.create_all()
+    version = db.session.query(db.func.max(SchemaVersion.version)).scalar()
+    if version is None:
+        # New databases are created with the current schema
+        version = 0 if existing_database else len(MIGRATIONS)
+        db.session.add(SchemaVersion(version=version))
+        db.session.commit()
+
+    for migration in MIGRATIONS[version:]:
+        begin_transaction()
+        try:
+            migration()
+            version += 1
+            SchemaVersion.query.update({'version': version})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def begin_transaction() -> None:
+    # pysqlite runs DDL like ALTER TABLE outside of any transaction, an
+    # explicit BEGIN makes each migration commit or roll back as a whole
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.in_transaction:
+        connection.exec_driver_sql('BEGIN')
+
+
+def rebuild_tables() -> None:
+    # Adds indexes and unique constraints, and stores datetimes as integers
+    # instead of strings. SQLite can't alter columns so the tables are
+    # recreated and their rows copied over.
+    connection = db.session.connection()
+    old_players = f'{Player.__tablename__}_old'
+
+    for model in (Player, RatingHistory, Game, User):
+        table = model.__table__
+        old_name = f'{table.name}_old'
+        if inspect(connection).has_table(old_name):
+            # Left by an interrupted run before migrations were atomic, the
+            # rows are still in the old table
+            table.drop(connection, checkfirst=True)
+        else:
+            connection.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"')
+        table.create(connection)
+
+        columns = ', '.join([f'"{c.name}"' for c in table.columns])
+        values = ', '.join([
+            f'CAST("{c.name}" AS INTEGER)' if isinstance(c.type, db.Integer) else f'"{c.name}"'
+            for c in table.columns
+        ])
+        if model in UNIQUE_KEYS:
+            keep = f'WHERE id IN (SELECT MIN(id) FROM "{old_name}" GROUP BY {UNIQUE_KEYS[model]})'
+        else:
+            keep = ''
+        if model is Player:
+            # Players are referenced by id, so duplicate names are renamed
+            connection.exec_driver_sql(
+                f'UPDATE "{old_players}" SET name = name || \'#\' || id '
+                f'WHERE id NOT IN (SELECT MIN(id) FROM "{old_players}" GROUP BY name)'
+            )
+        connection.exec_driver_sql(
+            f'INSERT INTO "{table.name}" ({columns}) '
+            f'SELECT {values} FROM "{old_name}" {keep} ORDER BY id'
+        )
+        connection.exec_driver_sql(f'DROP TABLE "{old_name}"')
+
+
+def backfill_game_participants() -> None:
+    # Games recorded before padelGameParticipants existed only have the
+    # comma separated team columns, fill the table from those.
+    if GameParticipant.query.first() is not None:
+        return
+    participants = []
+    for game_id, team1, team2 in db.session.query(Game.id, Game.team1, Game.team2):
+        for team, team_ids in ((1, team1), (2, team2)):
+            for p_id in team_ids.split(','):
+                participants.append({'game_id': game_id, 'player_id': int(p_id), 'team': team})
+    db.session.bulk_insert_mappings(GameParticipant, participants)
+
+
+def backfill_player_stats() -> None:
+    if PlayerStats.query.first() is None and Player.query.first() is not None:
+        rebuild_player_stats()
+
+
+def index_player_ranks() -> None:
+    for index in PlayerStats.__table__.indexes:
+        index.create(db.session.connection(), checkfirst=True)
+
+
+MIGRATIONS = [
+    rebuild_tables,
+    backfill_game_participants,
+    backfill_player_stats,
+    index_player_ranks,
+    rebuild_rating_snapshots,
+]
@@ -3,21 +3,23 @@ from . import db
 class Player(db.Model):
     __tablename__ = 'padelPlayers'
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(32))
+    name = db.Column(db.String(32), unique=True, index=True)
     rating = db.Column(db.Integer)
     rating_by_rounds = db.Column(db.Integer)
 
 
 class RatingHistory(db.Model):
     __tablename__ = 'padelRatingHistory'
+    # The unique constraint's index also serves lookups by player_id
+    __table_args__ = (db.UniqueConstraint('player_id', 'game_id'),)
     id = db.Column(db.Integer, primary_key=True)
     player_id = db.Column(db.Integer)
-    game_id = db.Column(db.Integer)
+    game_id = db.Column(db.Integer, index=True)
     rating = db.Column(db.Integer)
     rating_by_rounds = db.Column(db.Integer)
     rating_diff = db.Column(db.Integer)
     rounds_rating_diff = db.Column(db.Integer)
-    datetime = db.Column(db.String)
+    datetime = db.Column(db.Integer, index=True) # unix timestamp
 
 
 class Game(db.Model):
@@ -26,11 +28,78 @@ class Game(db.Model):
     team1 = db.Column(db.String) # "3,2"
     team2 = db.Column(db.String) # "0,1"
     score = db.Column(db.String) # "6,0" team1points, team2points
-    datetime = db.Column(db.String)
+    datetime = db.Column(db.Integer, index=True) # unix timestamp
+
+
+class GameParticipant(db.Model):
+    __tablename__ = 'padelGameParticipants'
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.Integer, index=True)
+    player_id = db.Column(db.Integer, index=True)
+    team = db.Column(db.Integer) # 1 or 2
+
+
+class PlayerStats(db.Model):
+    __tablename__ = 'padelPlayerStats'
+    player_id = db.Column(db.Integer, primary_key=True)
+    won_games = db.Column(db.Integer)
+    lost_games = db.Column(db.Integer)
+    won_rounds = db.Column(db.Integer)
+    lost_rounds = db.Column(db.Integer)
+    last_games = db.Column(db.String) # "+-++-" oldest first, at most 5
+    rank = db.Column(db.Integer, index=True)
 
 
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     password = db.Column(db.String)
-    username = db.Column(db.String)
+    username = db.Column(db.String, unique=True, index=True)
+
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schemaVersion'
+    version = db.Column(db.Integer, primary_key=True)
+
+
+class ChangeLog(db.Model):
+    # Append-only, ids are never reused so workers can tell entries apart
+    __tablename__ = 'padelChangeLog'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String) # "players", "games" or "all"
+    datetime = db.Column(db.Integer) # unix timestamp
+
+
+class RatingSnapshot(db.Model):
+    # Ratings of everyone who had played by then, right after game game_id.
+    # Taken every SNAPSHOT_INTERVAL games so past standings never need more
+    # than that many games of rating history on top of a snapshot.
+    __tablename__ = 'padelRatingSnapshots'
+    __table_args__ = (db.Index('ix_padelRatingSnapshots_position', 'datetime', 'game_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    datetime = db.Column(db.Integer)
+    game_id = db.Column(db.Integer)
+    player_id = db.Column(db.Integer)
+    rating = db.Column(db.Integer)
+    rating_by_rounds = db.Column(db.Integer)
+
+
+class Job(db.Model):
+    # Lives in the jobs database, see jobs.py
+    __bind_key__ = 'jobs'
+    __tablename__ = 'padelJobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String)
+    status = db.Column(db.String, index=True) # queued, running, done or failed
+    arguments = db.Column(db.String) # JSON
+    stage = db.Column(db.String)
+    processed = db.Column(db.Integer)
+    total = db.Column(db.Integer)
+    result = db.Column(db.String) # JSON
+    error = db.Column(db.String)
+    created = db.Column(db.Float) # unix timestamps
+    started = db.Column(db.Float)
+    stage_started = db.Column(db.Float)
+    heartbeat = db.Column(db.Float)
+    finished = db.Column(db.Float)
@@ -0,0 +1,145 @@
+# Pure-Python rating computation that works on plain game tuples instead of
+# ORM objects. The math is elo_utils.modified_elo inlined so that replaying a
+# long history does not pay for eight function calls per game, but every
+# operation is kept in the same order so the results are identical.
+import gc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+from .elo_utils import K_FACTOR, SCALE, START_RATING
+
+
+class PlayedGame(NamedTuple):
+    id: int
+    team1: Tuple[int, int]
+    team2: Tuple[int, int]
+    scores: Tuple[int, int]
+    datetime: int
+
+
+class RatingChange(NamedTuple):
+    player_id: int
+    game_id: int
+    rating: int
+    rating_by_rounds: int
+    rating_diff: int
+    rounds_rating_diff: int
+    datetime: int
+
+
+def game_from_row(game_id, team1: str, team2: str, score: str, datetime) -> PlayedGame:
+    # Builds a PlayedGame from the comma separated columns of padelGames
+    return PlayedGame(
+        game_id,
+        tuple(int(p_id) for p_id in team1.split(',')),
+        tuple(int(p_id) for p_id in team2.split(',')),
+        tuple(int(s) for s in score.split(',')),
+        datetime,
+    )
+
+
+@contextmanager
+def gc_paused():
+    # History is millions of small acyclic tuples on a full rebuild, letting
+    # the cyclic collector rescan them over and over only costs time.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+class _ExpectedResults(dict):
+    # Ratings are ints and team ratings halves of int sums, so only a few
+    # hundred distinct rating differences ever occur. Memoizing them skips
+    # the float power, and each value is computed with the same expression
+    # as elo_utils.expected_result.
+    def __missing__(self, diff):
+        value = self[diff] = 1 / (1 + 10 ** (diff / SCALE))
+        return value
+
+
+_EXPECTED = _ExpectedResults()
+
+
+def play_game(ratings: Dict[int, Tuple[int, int]], game: PlayedGame) -> List[RatingChange]:
+    # Applies one game to ratings ({player_id: (rating, rating_by_rounds)}) in
+    # place and returns the checkpoint of every player in it.
+    K = K_FACTOR
+    expected = _EXPECTED
+    game_id = game.id
+    datetime = game.datetime
+    team1_score, team2_score = game.scores
+
+    if team1_score == team2_score:
+        team1_res = team2_res = 0.5
+        team1_round_res = team2_round_res = 0.5
+    else:
+        team1_res = int(team1_score > team2_score)
+        team2_res = int(team2_score > team1_score)
+        team1_round_res = 1 / (team1_score + team2_score) * team1_score
+        team2_round_res = 1 / (team2_score + team1_score) * team2_score
+
+    (p1, p2), (p3, p4) = game.team1, game.team2
+    r1, q1 = ratings[p1]
+    r2, q2 = ratings[p2]
+    r3, q3 = ratings[p3]
+    r4, q4 = ratings[p4]
+
+    team1_rating = (r1 + r2) / 2
+    team2_rating = (r3 + r4) / 2
+    team1_round_rating = (q1 + q2) / 2
+    team2_round_rating = (q3 + q4) / 2
+
+    new_change = tuple.__new__
+    changes = []
+    for p_id, rating, rating_by_rounds, opponent_rating, opponent_round_rating, res, round_res in (
+        (p1, r1, q1, team2_rating, team2_round_rating, team1_res, team1_round_res),
+        (p2, r2, q2, team2_rating, team2_round_rating, team1_res, team1_round_res),
+        (p3, r3, q3, team1_rating, team1_round_rating, team2_res, team2_round_res),
+        (p4, r4, q4, team1_rating, team1_round_rating, team2_res, team2_round_res),
+    ):
+        new_rating = int(rating + K * (res - expected[opponent_rating - rating]))
+        new_rating_by_rounds = int(
+            rating_by_rounds + K * (round_res - expected[opponent_round_rating - rating_by_rounds])
+        )
+        ratings[p_id] = (new_rating, new_rating_by_rounds)
+        changes.append(new_change(RatingChange, (
+            p_id,
+            game_id,
+            new_rating,
+            new_rating_by_rounds,
+            new_rating - rating,
+            new_rating_by_rounds - rating_by_rounds,
+            datetime,
+        )))
+
+    return changes
+
+
+def replay_games(
+    games: Iterable[PlayedGame],
+    ratings: Dict[int, Tuple[int, int]] = None,
+    start_rating: int = START_RATING,
+    after_game: Callable[[PlayedGame, Dict[int, Tuple[int, int]]], None] = None
+) -> Tuple[Dict[int, Tuple[int, int]], List[RatingChange]]:
+    # Replays games in the given order starting from ratings (players missing
+    # from it start at start_rating). Returns the final ratings and the rating
+    # changes of every player of every game in play order. after_game is
+    # called with each game and the ratings right after it.
+    ratings = {} if ratings is None else dict(ratings)
+    start = (start_rating, start_rating)
+    history = []
+    extend = history.extend
+
+    with gc_paused():
+        for game in games:
+            for p_id in game.team1 + game.team2:
+                if p_id not in ratings:
+                    ratings[p_id] = start
+            extend(play_game(ratings, game))
+            if after_game is not None:
+                after_game(game, ratings)
+
+    return ratings, history
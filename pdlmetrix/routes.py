@@ -1,9 +1,13 @@
+import os
+import tempfile
 import time
+import zlib
 from flask import current_app as app
 from flask import render_template, request, redirect, url_for, Response, abort
-from .elo_utils import modified_elo
+from flask import stream_with_context, jsonify
 from . import databaseManager as DbManager
-from . import auth
+from . import auth, avatars, changes, jobs
+from .cache import cached_page
 
 
 @auth.verify_password
@@ -11,35 +15,173 @@ def verify_password(username, password):
     return DbManager.verify_password(username, password)
 
 
+@app.before_request
+def refresh_derived_state():
+    changes.refresh()
+
+
+GAMES_PER_PAGE = 50
+MAX_API_PAGE_SIZE = 500
+
+
+def games_page() -> dict:
+    page = max(request.args.get('page', 1, type=int), 1)
+    return {
+        'games': DbManager.games_table_data(
+            limit=GAMES_PER_PAGE,
+            offset=(page - 1) * GAMES_PER_PAGE
+        ),
+        'page': page,
+        'last_page': max((DbManager.count_games() - 1) // GAMES_PER_PAGE + 1, 1),
+    }
+
+
 @app.route('/')
+@cached_page
 def index():
     return render_template(
         'index.html',
         players=DbManager.players_table_data(),
-        games=DbManager.games_table_data(),
     )
 
 
+def api_page_args() -> tuple:
+    before = DbManager.parse_page_cursor(request.args.get('before'))
+    limit = request.args.get('limit', GAMES_PER_PAGE, type=int)
+    return before, min(max(limit, 1), MAX_API_PAGE_SIZE)
+
+
+@app.route('/api/games')
+def api_games():
+    before, limit = api_page_args()
+    return jsonify(DbManager.games_api_page(before, limit))
+
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    start = max(request.args.get('start', 1, type=int), 1)
+    limit = request.args.get('limit', GAMES_PER_PAGE, type=int)
+    limit = min(max(limit, 1), MAX_API_PAGE_SIZE)
+    return jsonify(DbManager.leaderboard_api_page(start, limit))
+
+
+def leaderboard_position() -> tuple:
+    # (datetime, game_id) from ?game_id= or ?datetime=, now by default
+    game_id = request.args.get('game_id', type=int)
+    if game_id is not None:
+        game = DbManager.get_game_by_id(game_id)
+        if game is None:
+            abort(404)
+        return game.datetime, game.id
+    return request.args.get('datetime', int(time.time()), type=int), None
+
+
+@app.route('/api/leaderboard/as_of')
+def api_leaderboard_as_of():
+    datetime, game_id = leaderboard_position()
+    return jsonify({
+        'datetime': datetime,
+        'game_id': game_id,
+        'players': DbManager.leaderboard_as_of(datetime, game_id),
+    })
+
+
+@app.route('/leaderboard')
+@cached_page
+def leaderboard():
+    date = request.args.get('date')
+    if date:
+        try:
+            # End of the given day
+            datetime = int(time.mktime(time.strptime(date, '%Y-%m-%d'))) + 24 * 60 * 60 - 1
+        except ValueError:
+            abort(400)
+        game_id = None
+    else:
+        datetime, game_id = leaderboard_position()
+    return render_template(
+        'leaderboard.html',
+        date=time.strftime('%Y-%m-%d', time.localtime(datetime)),
+        game_id=game_id,
+        players=DbManager.leaderboard_as_of(datetime, game_id),
+    )
+
+
+@app.route('/api/matchmaking')
+def api_matchmaking():
+    # ?players=name,name,...&recent_games=10&partner_penalty=0.05
+    player_names = [n for n in request.args.get('players', '').split(',') if n]
+    try:
+        courts = DbManager.matchmaking_courts(
+            player_names,
+            request.args.get('recent_games', 10, type=int),
+            request.args.get('partner_penalty', 0.05, type=float),
+        )
+    except (AssertionError, KeyError):
+        abort(400)
+    return jsonify(courts)
+
+
+@app.route('/api/player/<player_name>/games')
+def api_player_games(player_name):
+    player = DbManager.get_player_record(player_name)
+    if not player:
+        abort(404)
+    before, limit = api_page_args()
+    return jsonify(DbManager.player_games_api_page(player, before, limit))
+
+
+@app.route('/api/player/<player_name>/rating_history')
+def api_player_rating_history(player_name):
+    player = DbManager.get_player_record(player_name)
+    if not player:
+        abort(404)
+    points = request.args.get('points', type=int)
+    return jsonify(DbManager.get_rating_history(player, points))
+
+
 @app.route('/player/<player_name>')
+@cached_page
 def player(player_name):
-    player = DbManager.get_player_by_name(player_name)
+    player = DbManager.get_player_record(player_name)
     if not player:
         abort(404)
     return render_template(
         'player.html',
         player=player,
         data=DbManager.get_player_stats(player),
-        games=DbManager.get_games_by_player_formatted(player),
         others=DbManager.get_player_partner_enemy(player),
+        avatar_version=avatars.AVATAR_VERSION,
     )
 
+@app.route('/avatar/<player_name>.svg')
+def avatar(player_name):
+    if not DbManager.get_player_record(player_name):
+        abort(404)
+    svg, etag = avatars.get_avatar(player_name)
+    response = Response(svg, mimetype='image/svg+xml')
+    # Pages link avatars with the avatar version, so browsers can keep
+    # them for a year
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@app.route('/chemistry')
+def chemistry():
+    return jsonify(DbManager.chemistry_table_data())
+
+
 @app.route('/admin')
 @auth.login_required
 def admin():
     return render_template(
         'admin.html',
+        jobs=jobs.recent_jobs(),
         players=DbManager.get_all_players(),
-        games=DbManager.games_table_data(),
+        **games_page(),
     )
 
 
@@ -80,37 +222,127 @@ def new_game():
     return redirect(url_for('index'))
 
 
+@app.route('/new_games', methods=['POST'])
+@auth.login_required
+def new_games():
+    # JSON list of {"team1": [id, id], "team2": [id, id], "score": [t1, t2],
+    # "datetime": optional unix timestamp}, recorded all or nothing.
+    games = []
+    try:
+        for game in request.get_json(force=True):
+            team1_ids = [int(p_id) for p_id in game['team1']]
+            team2_ids = [int(p_id) for p_id in game['team2']]
+            scores = [int(s) for s in game['score']]
+            datetime = game.get('datetime')
+            all_player_ids = team1_ids + team2_ids
+            assert len(team1_ids) == len(team2_ids) == 2
+            assert len(set(all_player_ids)) == len(all_player_ids)
+            assert len(scores) == 2 and min(scores) >= 0
+            games.append((
+                team1_ids,
+                team2_ids,
+                scores,
+                None if datetime is None else int(datetime)
+            ))
+        game_ids = DbManager.add_games(games)
+    except (AssertionError, KeyError, TypeError, ValueError):
+        abort(400)
+
+    return jsonify({'game_ids': game_ids})
+
+
+def job_response(job_id: int):
+    # Forms go back to the admin page, which lists the jobs, API clients
+    # asking for JSON get the job to poll
+    accept = request.accept_mimetypes
+    if accept.accept_json and not accept.accept_html:
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id),
+        }), 202
+    return redirect(url_for('admin'))
+
+
+@app.route('/jobs/<int:job_id>')
+@auth.login_required
+def job_status(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+
 @app.route('/delete_game', methods=['POST'])
 @auth.login_required
 def delete_game():
     game_id = int(request.form.get('game_id'))
-    if game_id is not None:
-        DbManager.remove_game(game_id)
-    return redirect(url_for('index'))
+    return job_response(jobs.enqueue('remove_game', {'game_id': game_id}))
+
+
+@app.route('/edit_game', methods=['POST'])
+@auth.login_required
+def edit_game():
+    game_id = int(request.form.get('game_id'))
+    t1score = request.form.get('t1score')
+    t2score = request.form.get('t2score')
+
+    if None in [t1score, t2score]:
+        return redirect(url_for('admin'))
+
+    return job_response(jobs.enqueue(
+        'edit_game_score',
+        {'game_id': game_id, 'scores': [int(t1score), int(t2score)]}
+    ))
 
 
 @app.route('/download_games', methods=['GET'])
 @auth.login_required
 def download_games():
     time_now = int(time.time())
+    since = request.args.get('since', type=int)
+    use_gzip = request.args.get('gzip') == '1'
+    filename = f'games_backup_{time_now}.txt'
+    if since is not None:
+        filename = f'games_backup_{since}_{time_now}.txt'
+
+    chunks = (c.encode('UTF-8') for c in DbManager.iter_backup_chunks(since))
+    if use_gzip:
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+
     return Response(
-        DbManager.create_backup(),
-        mimetype='text/plain',
+        stream_with_context(chunks),
+        mimetype='application/gzip' if use_gzip else 'text/plain',
         headers={
-            'Content-Disposition': f'attachment;filename=games_backup_{time_now}.txt'
+            'Content-Disposition': f'attachment;filename={filename}'
         }
     )
 
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31) # 31 = gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
 @app.route('/load_from_backup', methods=['POST'])
 @auth.login_required
 def load_from_backup():
+    # Spooled to disk in chunks, the job streams it from there
     backup_file = request.files['backup_file']
-    DbManager.load_from_backup(backup_file)
-    return redirect(url_for('index'))
+    fd, path = tempfile.mkstemp(prefix='pdlmetrix-backup-')
+    with os.fdopen(fd, 'wb') as spool:
+        backup_file.save(spool)
+    return job_response(jobs.enqueue(
+        'load_from_backup',
+        {'path': path, 'gzipped': backup_file.filename.endswith('.gz')}
+    ))
 
 
 @app.route('/clear_database')
 @auth.login_required
 def clear_database():
-    DbManager.clear_database()
-    return redirect(url_for('index'))
+    return job_response(jobs.enqueue('clear_database'))
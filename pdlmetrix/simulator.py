@@ -0,0 +1,153 @@
+# What-if replays of the whole game history under other rating parameters,
+# scored by how well each configuration predicted the games it rated: before
+# a game is rated, the expected result of team 1 from the team averages is
+# its predicted chance of winning. Configurations are replayed in parallel
+# on a process pool.
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, NamedTuple, Tuple
+from .elo_utils import K_FACTOR, SCALE, START_RATING
+
+# Predictions are clamped this far from 0 and 1 for the log-loss
+EPSILON = 1e-15
+
+
+class RatingConfig(NamedTuple):
+    k_factor: float = K_FACTOR
+    scale: float = SCALE
+    start_rating: int = START_RATING
+    # Rate by the share of rounds won (rating_by_rounds) instead of win/loss
+    proportional: bool = False
+    # Compare team averages for both teams instead of each player's own
+    # rating against the opposing team's average
+    team_expectation: bool = False
+
+
+class SimulationResult(NamedTuple):
+    config: RatingConfig
+    games: int
+    log_loss: float
+    brier: float
+    accuracy: float # share of decided games whose winner was favoured
+
+
+# (team1 player, team1 player, team2 player, team2 player, team1 score,
+# team2 score) with players as indexes 0..n_players - 1
+SimulatedGame = Tuple[int, int, int, int, int, int]
+
+
+def config_grid(
+    k_factors: Iterable[float],
+    scales: Iterable[float],
+    start_ratings: Iterable[int] = (START_RATING,),
+    proportional: Iterable[bool] = (False, True),
+    team_expectation: Iterable[bool] = (False, True)
+) -> List[RatingConfig]:
+    return [
+        RatingConfig(*values) for values in
+        itertools.product(k_factors, scales, start_ratings, proportional, team_expectation)
+    ]
+
+
+def replay(games: List[SimulatedGame], n_players: int, config: RatingConfig) -> tuple:
+    # Returns the final ratings and the summed log-loss, squared error,
+    # correct predictions and decided games
+    k, scale, start_rating, proportional, team_expectation = config
+    ratings = [start_rating] * n_players
+    log = math.log
+    log_loss = 0.0
+    squared_error = 0.0
+    correct = 0
+    decided = 0
+
+    for p1, p2, p3, p4, team1_score, team2_score in games:
+        r1 = ratings[p1]
+        r2 = ratings[p2]
+        r3 = ratings[p3]
+        r4 = ratings[p4]
+        team1_rating = (r1 + r2) / 2
+        team2_rating = (r3 + r4) / 2
+
+        # Same expressions as elo_utils.result and rating_engine.play_game
+        if team1_score == team2_score:
+            team1_res = team2_res = 0.5
+        elif proportional:
+            team1_res = 1 / (team1_score + team2_score) * team1_score
+            team2_res = 1 / (team2_score + team1_score) * team2_score
+        else:
+            team1_res = int(team1_score > team2_score)
+            team2_res = int(team2_score > team1_score)
+
+        predicted = 1 / (1 + 10 ** ((team2_rating - team1_rating) / scale))
+        outcome = 0.5 if team1_score == team2_score else float(team1_score > team2_score)
+        clamped = min(max(predicted, EPSILON), 1 - EPSILON)
+        log_loss -= outcome * log(clamped) + (1 - outcome) * log(1 - clamped)
+        squared_error += (predicted - outcome) ** 2
+        if outcome != 0.5:
+            decided += 1
+            correct += (predicted > 0.5) == (outcome == 1)
+
+        if team_expectation:
+            e1 = e2 = predicted
+            e3 = e4 = 1 / (1 + 10 ** ((team1_rating - team2_rating) / scale))
+        else:
+            e1 = 1 / (1 + 10 ** ((team2_rating - r1) / scale))
+            e2 = 1 / (1 + 10 ** ((team2_rating - r2) / scale))
+            e3 = 1 / (1 + 10 ** ((team1_rating - r3) / scale))
+            e4 = 1 / (1 + 10 ** ((team1_rating - r4) / scale))
+        ratings[p1] = int(r1 + k * (team1_res - e1))
+        ratings[p2] = int(r2 + k * (team1_res - e2))
+        ratings[p3] = int(r3 + k * (team2_res - e3))
+        ratings[p4] = int(r4 + k * (team2_res - e4))
+
+    return ratings, log_loss, squared_error, correct, decided
+
+
+def simulate(games: List[SimulatedGame], n_players: int, config: RatingConfig) -> SimulationResult:
+    _, log_loss, squared_error, correct, decided = replay(games, n_players, config)
+    n_games = max(len(games), 1)
+    return SimulationResult(
+        config,
+        len(games),
+        log_loss / n_games,
+        squared_error / n_games,
+        correct / decided if decided else 0.0,
+    )
+
+
+_worker_games = None
+_worker_players = None
+
+
+def _init_worker(games: List[SimulatedGame], n_players: int) -> None:
+    # The history is sent to each worker once instead of with every config
+    global _worker_games, _worker_players
+    _worker_games = games
+    _worker_players = n_players
+
+
+def _simulate_in_worker(config: RatingConfig) -> SimulationResult:
+    return simulate(_worker_games, _worker_players, config)
+
+
+def sweep(
+    games: List[SimulatedGame],
+    n_players: int,
+    configs: List[RatingConfig],
+    processes: int = None
+) -> List[SimulationResult]:
+    # Simulates every config, best (lowest log-loss) first
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        results = [simulate(games, n_players, config) for config in configs]
+    else:
+        with ProcessPoolExecutor(
+            processes,
+            initializer=_init_worker,
+            initargs=(games, n_players)
+        ) as pool:
+            chunksize = max(len(configs) // (processes * 4), 1)
+            results = list(pool.map(_simulate_in_worker, configs, chunksize=chunksize))
+    return sorted(results, key=lambda r: (r.log_loss, r.brier))
@@ -0,0 +1,57 @@
+let gamesCursor = null;
+
+const playerCell = (players) => {
+  const cell = document.createElement("td");
+  players.forEach((player, i) => {
+    if (i > 0) {
+      cell.appendChild(document.createElement("br"));
+    }
+    cell.appendChild(document.createTextNode(
+      `${player.name} (${player.rating_diff} / ${player.rounds_rating_diff})`
+    ));
+  });
+  return cell;
+}
+
+const scoreCell = (score, isWinner) => {
+  const cell = document.createElement("td");
+  if (isWinner) {
+    const bold = document.createElement("b");
+    bold.textContent = score;
+    cell.appendChild(bold);
+  } else {
+    cell.textContent = score;
+  }
+  return cell;
+}
+
+const gameRow = (game) => {
+  const row = document.createElement("tr");
+  const dateCell = document.createElement("td");
+  dateCell.textContent = game.datetime;
+  const team1Won = Number(game.team1score) > Number(game.team2score);
+
+  row.appendChild(dateCell);
+  row.appendChild(playerCell(game.players.slice(0, 2)));
+  row.appendChild(scoreCell(game.team1score, team1Won));
+  row.appendChild(scoreCell(game.team2score, !team1Won));
+  row.appendChild(playerCell(game.players.slice(2, 4)));
+  return row;
+}
+
+const loadGames = async () => {
+  const params = new URLSearchParams({ limit: 50 });
+  if (gamesCursor) {
+    params.set("before", gamesCursor);
+  }
+  const response = await fetch(`/api/games?${params}`);
+  const page = await response.json();
+
+  const table = document.getElementById("gamesTable");
+  page.games.forEach((game) => table.appendChild(gameRow(game)));
+
+  gamesCursor = page.next_cursor;
+  document.getElementById("moreGamesButton").hidden = gamesCursor === null;
+}
+
+loadGames();
@@ -17,22 +17,28 @@ const drawWinPercentageGraph = (canvasId, percentage, isMatches) => {
   ctx.stroke();
 }
 
-const drawTotalGraph = (canvasId, playerData) => {
+const drawTotalGraph = async (canvasId) => {
   const canvas = document.getElementById(canvasId);
   const ctx = canvas.getContext("2d");
   canvas.width = canvas.clientWidth;
   canvas.height = canvas.clientHeight;
 
+  const points = Math.max(canvas.width, 100);
+  const playerName = encodeURIComponent(PLAYER_NAME);
+  const response = await fetch(`/api/player/${playerName}/rating_history?points=${points}`);
+  const history = await response.json();
+  const toXY = (series) => series.map(([x, y]) => ({ x: x, y: y }));
+
   const matchData = {
     label: "Match",
-    data: playerData.elo_history,
+    data: toXY(history.elo_history),
     borderColor: "#8cb369",
     fill: false,
     lineTension: 0.3,
   };
   const pointsData = {
     label: "Points",
-    data: playerData.points_elo_history,
+    data: toXY(history.points_elo_history),
     borderColor: "#a0c4ff",
     fill: false,
     lineTension: 0.3,
@@ -41,7 +47,6 @@ const drawTotalGraph = (canvasId, playerData) => {
   const lineGraph = new Chart(canvas, {
     type: "line",
     data: {
-      labels: playerData.elo_history,
       datasets: [matchData, pointsData],
     },
     options: {
@@ -55,6 +60,7 @@ const drawTotalGraph = (canvasId, playerData) => {
       },
       scales: {
         x: {
+          type: "linear",
           display: false,
         },
       },
@@ -69,9 +75,44 @@ const drawTotalGraph = (canvasId, playerData) => {
 }
 
 
+let playerGamesCursor = null;
+
+const playerGameRow = (game) => {
+  const row = document.createElement("tr");
+  row.className = "playerGameTableItem";
+  const cells = [game.team1, game.score, game.team2].map((text) => {
+    const cell = document.createElement("td");
+    cell.textContent = text;
+    return cell;
+  });
+  if (game.result === 2) {
+    cells[1].className = "winGame";
+  } else if (game.result === 0) {
+    cells[1].className = "loseGame";
+  }
+  cells.forEach((cell) => row.appendChild(cell));
+  return row;
+}
+
+const loadPlayerGames = async () => {
+  const params = new URLSearchParams({ limit: 50 });
+  if (playerGamesCursor) {
+    params.set("before", playerGamesCursor);
+  }
+  const playerName = encodeURIComponent(PLAYER_NAME);
+  const response = await fetch(`/api/player/${playerName}/games?${params}`);
+  const page = await response.json();
+
+  const table = document.getElementById("playerGamesTable");
+  page.games.forEach((game) => table.appendChild(playerGameRow(game)));
+
+  playerGamesCursor = page.next_cursor;
+  document.getElementById("morePlayerGamesButton").hidden = playerGamesCursor === null;
+}
+
+
 const drawGraphs = () => {
-  console.log(PLAYER_DATA);
   drawWinPercentageGraph("matchesWinPercentageCanvas", PLAYER_DATA.win_perc, true);
   drawWinPercentageGraph("pointsWinPercentageCanvas", PLAYER_DATA.round_win_perc, false);
-  drawTotalGraph("eloGraphCanvas", PLAYER_DATA);
+  drawTotalGraph("eloGraphCanvas");
 }
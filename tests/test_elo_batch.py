@@ -0,0 +1,89 @@
+import random
+import numpy as np
+from pdlmetrix.elo_batch import _TABLE_RANGE, games_to_arrays, replay_games_batch
+from pdlmetrix.elo_utils import START_RATING, modified_elo
+from pdlmetrix.rating_engine import PlayedGame, replay_games
+
+
+def random_games(n_games: int, player_ids: list, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    games = []
+    for game_id in range(1, n_games + 1):
+        p1, p2, p3, p4 = rng.sample(player_ids, 4)
+        # Plenty of ties, including 0-0
+        scores = (rng.randint(0, 3), rng.randint(0, 3))
+        games.append(PlayedGame(game_id, (p1, p2), (p3, p4), scores, game_id))
+    return games
+
+
+def scalar_game(ratings: dict, game: PlayedGame) -> dict:
+    # One game rated with elo_utils.modified_elo directly
+    (p1, p2), (p3, p4) = game.team1, game.team2
+    s1, s2 = game.scores
+    new_ratings = {}
+    for index in (0, 1):
+        team1 = (ratings[p1][index] + ratings[p2][index]) / 2
+        team2 = (ratings[p3][index] + ratings[p4][index]) / 2
+        raw_result = index == 0
+        for p_id, opponents, own, other in (
+            (p1, team2, s1, s2), (p2, team2, s1, s2), (p3, team1, s2, s1), (p4, team1, s2, s1)
+        ):
+            new_ratings.setdefault(p_id, [None, None])[index] = modified_elo(
+                ratings[p_id][index], opponents, own, other, raw_result=raw_result
+            )
+    return {p_id: tuple(r) for p_id, r in new_ratings.items()}
+
+
+def batch_replay(games: list, player_ids: list, start: dict):
+    player_idx, scores = games_to_arrays(games, player_ids)
+    ratings = np.array([start[p_id] for p_id in player_ids], dtype=np.int64)
+    return replay_games_batch(player_idx, scores, ratings)
+
+
+def test_batch_matches_modified_elo():
+    player_ids = list(range(1, 9))
+    games = random_games(500, player_ids)
+    start = {p_id: (START_RATING, START_RATING) for p_id in player_ids}
+
+    ratings = dict(start)
+    expected = []
+    for game in games:
+        ratings.update(scalar_game(ratings, game))
+        expected.append([ratings[p_id] for p_id in game.team1 + game.team2])
+
+    final, trajectories, _ = batch_replay(games, player_ids, start)
+    assert trajectories.tolist() == [[list(r) for r in game] for game in expected]
+    assert final.tolist() == [list(ratings[p_id]) for p_id in player_ids]
+
+
+def test_batch_matches_rating_engine():
+    player_ids = list(range(1, 41))
+    games = random_games(3000, player_ids, seed=1)
+    start = {p_id: (START_RATING, START_RATING) for p_id in player_ids}
+
+    ratings, history = replay_games(games, start)
+    final, trajectories, diffs = batch_replay(games, player_ids, start)
+
+    assert final.tolist() == [list(ratings[p_id]) for p_id in player_ids]
+    assert trajectories.reshape(-1, 2).tolist() == [
+        [change.rating, change.rating_by_rounds] for change in history
+    ]
+    assert diffs.reshape(-1, 2).tolist() == [
+        [change.rating_diff, change.rounds_rating_diff] for change in history
+    ]
+
+
+def test_batch_falls_back_beyond_lookup_table():
+    # A gap larger than the lookup table is rated without it
+    player_ids = list(range(1, 9))
+    games = random_games(200, player_ids, seed=2)
+    start = {p_id: (START_RATING, START_RATING) for p_id in player_ids}
+    start[1] = (START_RATING + 3 * _TABLE_RANGE, START_RATING - 3 * _TABLE_RANGE)
+
+    ratings, history = replay_games(games, start)
+    final, trajectories, _ = batch_replay(games, player_ids, start)
+
+    assert final.tolist() == [list(ratings[p_id]) for p_id in player_ids]
+    assert trajectories.reshape(-1, 2).tolist() == [
+        [change.rating, change.rating_by_rounds] for change in history
+    ]